@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Synthetic schema generators for benchmarks.
+
+Each generator yields DDL statements for SQLite. Names are
+deterministic, foreign key targets are drawn from a seeded random
+generator, so the same arguments always produce the same schema.
+"""
+
+import random
+
+
+def table_name(i):
+    return 't%06d' % i
+
+
+def generate(tables, columns=5, fks=1, seed=0):
+    """Yields create table statements.
+
+    :param tables: Number of tables.
+    :param columns: Number of columns per table, not counting the
+      primary key and foreign key columns.
+    :param fks: Number of foreign keys per table. Each foreign key
+      references a random table created before, the first table
+      has none.
+    """
+    rnd = random.Random(seed)
+    for i in range(tables):
+        cols = ['id integer primary key']
+        cols.extend('c%d text' % j for j in range(columns))
+        if i > 0:
+            for j in range(fks):
+                cols.append('fk%d integer references %s'
+                            % (j, table_name(rnd.randrange(i))))
+        yield 'create table %s (%s)' % (table_name(i), ', '.join(cols))
+
+
+def create(conn, tables, columns=5, fks=1, seed=0):
+    """Creates a synthetic schema on a sqlite3 connection."""
+    conn.execute('begin')
+    for statement in generate(tables, columns=columns, fks=fks, seed=seed):
+        conn.execute(statement)
+    conn.execute('commit')
+
+
+#: Schema shapes, tables are capped to keep the databases reasonable.
+SCENARIOS = {
+    'tables': {'columns': 5, 'fks': 1, 'max_tables': None},
+    'wide': {'columns': 250, 'fks': 0, 'max_tables': 1000},
+    'dense': {'columns': 2, 'fks': 20, 'max_tables': 10000},
+}
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Compares the memory footprint of database object trees.
+
+Builds a synthetic schema once with the dict based node layout used
+before nodes got ``__slots__`` and once with :mod:`dbschema.objects`,
+and reports the memory allocated for each tree. The figures for
+:mod:`dbschema.objects` include the lookup indexes kept by
+:class:`dbschema.objects.Database`, the memory used by the nodes and
+by the indexes is also reported separately.
+
+Usage: PYTHONPATH=. python benchmarks/memory.py [--tables N] [--columns N]
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from dbschema import objects
+
+
+class LegacyNode(object):
+    """Replica of the node layout before __slots__ were introduced."""
+
+    def __init__(self, name, **kwargs):
+        self.children = set([])
+        self.parent = None
+        self.name = name
+        self.description = None
+        self.oid = None
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+
+    @property
+    def db(self):
+        if self.parent is None:
+            return self
+        return self.parent.db
+
+    def add_child(self, obj):
+        obj.parent = self
+        self.children.add(obj)
+        self.db._oid_idx[obj.oid] = obj
+        return obj
+
+
+def build_legacy(tables, columns):
+    db = LegacyNode('db')
+    db._oid_idx = {}
+    nsp = db.add_child(LegacyNode('public', oid=1))
+    for i in range(tables):
+        table = nsp.add_child(LegacyNode('table%d' % i, oid='t%d' % i))
+        for j in range(columns):
+            table.add_child(LegacyNode('col%d' % j, oid='t%d.%d' % (i, j)))
+    return db
+
+
+def build_slotted(tables, columns):
+    db = objects.Database('db')
+    nsp = db.add_child(objects.Namespace('public', oid=1))
+    for i in range(tables):
+        table = nsp.add_child(objects.Table('table%d' % i, oid='t%d' % i))
+        for j in range(columns):
+            table.add_child(objects.Column('col%d' % j, oid='t%d.%d' % (i, j)))
+    return db
+
+
+#: Lookup indexes of :class:`dbschema.objects.Database`.
+INDEXES = ('_oid_idx', '_type_idx', '_name_idx', '_fk_idx')
+
+
+def measure(builder, tables, columns):
+    """Returns total, index and peak memory of a tree in bytes."""
+    gc.collect()
+    tracemalloc.start()
+    tree = builder(tables, columns)
+    current, peak = tracemalloc.get_traced_memory()
+    indexes = 0
+    if isinstance(tree, objects.Database):
+        # Drop the indexes, what they held is the index memory.
+        for attr in INDEXES:
+            setattr(tree, attr, {})
+        gc.collect()
+        indexes = current - tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tree
+    return current, indexes, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tables', type=int, default=1000)
+    parser.add_argument('--columns', type=int, default=50)
+    args = parser.parse_args()
+    nodes = args.tables * (args.columns + 1) + 2
+    print('Synthetic schema: %d tables x %d columns (%d nodes)'
+          % (args.tables, args.columns, nodes))
+    results = []
+    for label, builder in (('before (dict)', build_legacy),
+                           ('after (slots)', build_slotted)):
+        current, indexes, peak = measure(builder, args.tables, args.columns)
+        results.append(current)
+        print('%-14s %10.1f MiB  %6d bytes/node  (peak %.1f MiB)'
+              % (label, current / 2.0 ** 20, current // nodes,
+                 peak / 2.0 ** 20))
+        if indexes:
+            print('  nodes        %10.1f MiB'
+                  % ((current - indexes) / 2.0 ** 20))
+            print('  indexes      %10.1f MiB' % (indexes / 2.0 ** 20))
+    print('ratio          %10.2fx' % (float(results[0]) / results[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Compares bulk and per-table pragma introspection for SQLite.
+
+Creates a database with many tables, each with a foreign key to the
+previous one, and times loading all columns and foreign keys once
+with the table-valued pragma functions and once with one pragma
+statement per table.
+
+Usage: PYTHONPATH=. python benchmarks/sqlite_pragmas.py [--tables N]
+"""
+
+import argparse
+import sqlite3
+import time
+
+import dbschema
+from dbschema import objects
+
+
+def create_schema(conn, tables):
+    statements = ['create table t0 (id integer primary key, val text)']
+    for i in range(1, tables):
+        statements.append(
+            'create table t%d (id integer primary key, val text,'
+            ' ref integer references t%d)' % (i, i - 1))
+    conn.executescript(';'.join(statements))
+
+
+def run(conn, bulk):
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, conn)
+    db._pragma_functions = bulk
+    start = time.time()
+    db.refresh_types(set([objects.Column, objects.ForeignKey]))
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tables', type=int, default=5000)
+    args = parser.parse_args()
+    conn = sqlite3.connect(':memory:')
+    create_schema(conn, args.tables)
+    print('SQLite %s, %d tables' % (sqlite3.sqlite_version, args.tables))
+    per_table = run(conn, False)
+    bulk = run(conn, True)
+    print('per-table pragmas %8.3fs' % per_table)
+    print('bulk pragmas      %8.3fs' % bulk)
+    print('speedup           %8.2fx' % (per_table / bulk))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Measures latency and memory of the public API on synthetic schemas.
+
+Generates SQLite databases (see generators.py) for every scenario and
+size and measures:
+
+* ``open``: :func:`dbschema.open` until the tree is initialized,
+* ``get_tables``: listing all tables,
+* ``get_columns``: the first call, which loads all columns
+  (``*_cold_s``), and the mean of subsequent calls (``*_warm_us``),
+* ``get_reverse_foreign_keys``: same as get_columns,
+* ``find_exact``: mean of lookups by table name,
+* ``peak_memory``: peak memory allocated while opening and fully
+  loading the database (measured in a separate run).
+
+Results are written as JSON. With --compare the results are compared
+to a previous run and changes are printed.
+
+Usage: PYTHONPATH=. python benchmarks/suite.py [--sizes 100,1000,10000]
+  [--scenarios tables,wide,dense] [--output results.json]
+  [--compare baseline.json]
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from timeit import default_timer as timer
+
+import dbschema
+from dbschema import objects
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import generators  # NOQA
+
+
+LOOKUPS = 1000
+
+
+def _mean_us(func, args):
+    start = timer()
+    for arg in args:
+        func(arg)
+    return (timer() - start) / max(len(args), 1) * 1e6
+
+
+def measure(path, tables):
+    result = {}
+    start = timer()
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, database=path)
+    result['open_s'] = timer() - start
+
+    start = timer()
+    all_tables = list(db.get_tables())
+    result['get_tables_s'] = timer() - start
+
+    rnd = random.Random(0)
+    sample = [rnd.choice(all_tables) for _ in range(LOOKUPS)]
+
+    start = timer()
+    list(sample[0].get_columns())
+    result['get_columns_cold_s'] = timer() - start
+    result['get_columns_warm_us'] = _mean_us(
+        lambda t: list(t.get_columns()), sample)
+
+    start = timer()
+    list(sample[0].get_reverse_foreign_keys())
+    result['get_reverse_foreign_keys_cold_s'] = timer() - start
+    result['get_reverse_foreign_keys_warm_us'] = _mean_us(
+        lambda t: list(t.get_reverse_foreign_keys()), sample)
+
+    names = [t.name for t in sample]
+    result['find_exact_us'] = _mean_us(
+        lambda name: db.find_exact(type_cls=objects.Table, name=name), names)
+
+    result['columns'] = sum(1 for _ in db.find(type_cls=objects.Column))
+    result['foreign_keys'] = sum(
+        1 for _ in db.find(type_cls=objects.ForeignKey))
+    db.close()
+    return result
+
+
+def measure_memory(path):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        db = dbschema.open(dbschema.BACKEND_SQLITE3, database=path)
+        db.refresh_all()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    db.close()
+    return peak
+
+
+def run(scenarios, sizes, tmpdir, log):
+    results = []
+    for name in scenarios:
+        shape = generators.SCENARIOS[name]
+        for size in sizes:
+            if shape['max_tables'] is not None and size > shape['max_tables']:
+                log('skipping %s with %d tables' % (name, size))
+                continue
+            path = os.path.join(tmpdir, '%s_%d.db' % (name, size))
+            conn = sqlite3.connect(path, isolation_level=None)
+            start = timer()
+            generators.create(conn, size, columns=shape['columns'],
+                              fks=shape['fks'])
+            conn.close()
+            log('%s: created %d tables in %.1fs'
+                % (name, size, timer() - start))
+            result = {'scenario': name, 'tables': size}
+            result.update(measure(path, size))
+            result['peak_memory_bytes'] = measure_memory(path)
+            results.append(result)
+            os.remove(path)
+    return results
+
+
+def compare(results, baseline):
+    def key(r):
+        return r['scenario'], r['tables']
+    previous = dict((key(r), r) for r in baseline['results'])
+    lines = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        for metric in sorted(result):
+            if not metric.endswith(('_s', '_us', '_bytes')):
+                continue
+            if not old.get(metric):
+                continue
+            change = (result[metric] - old[metric]) / float(old[metric])
+            lines.append('%-8s %7d %-34s %+7.1f%%'
+                         % (result['scenario'], result['tables'], metric,
+                            change * 100))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help='comma separated numbers of tables')
+    parser.add_argument('--scenarios', default=','.join(
+        sorted(generators.SCENARIOS)))
+    parser.add_argument('--output', help='JSON file (default: stdout)')
+    parser.add_argument('--compare', help='JSON file of a previous run')
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+    scenarios = args.scenarios.split(',')
+    for name in scenarios:
+        if name not in generators.SCENARIOS:
+            parser.error('unknown scenario %r' % name)
+
+    def log(msg):
+        sys.stderr.write('%s\n' % msg)
+
+    tmpdir = tempfile.mkdtemp(prefix='dbschema-bench-')
+    try:
+        results = run(scenarios, sizes, tmpdir, log)
+    finally:
+        shutil.rmtree(tmpdir)
+    data = {
+        'meta': {
+            'dbschema': dbschema.__version__,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+    }
+    output = json.dumps(data, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        for line in compare(results, baseline):
+            log(line)
+
+
+if __name__ == '__main__':
+    main()
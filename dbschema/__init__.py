@@ -3,6 +3,11 @@
 __version__ = '0.1.0-dev'
 
 from . import backends
+from . import instrumentation
+from .compare import DiffResult, diff
+from .parallel import OpenResult, open_many
+from .pool import ConnectionPool
+from .snapshot import open_snapshot, save_snapshot
 
 
 # TODO(andi) Do we really need this constants here?  Maybe backends is
@@ -12,7 +17,11 @@ BACKEND_POSTGRESQL = 'postgresql' #: Identifier for PostgreSQL databases.
 BACKEND_SQLITE3 = 'sqlite3'       #: Identifier for SQLite3 databases.
 
 
-def open(backend, connection=None, log_sql=False, **connect_kwargs):
+def open(backend, connection=None, log_sql=False, scoped_refresh=False,
+         fetch_size=1000, server_side_cursors=False, itersize=2000,
+         refresh_workers=1, pool=None, hook=None, system_namespaces=True,
+         namespaces=None, exclude_namespaces=None, track_changes=False,
+         **connect_kwargs):
     """Returns a :class:`Schema` instance.
 
     :param backend: Backend identifier, must be one of
@@ -21,18 +30,88 @@ def open(backend, connection=None, log_sql=False, **connect_kwargs):
       connection.
     :type connection: DB-API2 connection or None
     :param log_sql: If ``True`` SQL statements are logged (default: ``False``).
+    :param scoped_refresh: If ``True`` children like columns or
+      foreign keys are loaded per table when they are first requested
+      instead of for the whole database (default: ``False``).
+    :param fetch_size: Number of rows fetched at once when reading
+      query results (default: ``1000``).
+    :param server_side_cursors: If ``True`` large catalog queries are
+      read through server-side cursors, so that the result isn't
+      transferred to the client at once. Currently only supported by
+      PostgreSQL (default: ``False``).
+    :param itersize: Number of rows fetched at once from server-side
+      cursors (default: ``2000``).
+    :param refresh_workers: Number of connections used to refresh
+      independent types like columns and foreign keys in parallel.
+      Additional connections are only opened if connect_kwargs are
+      given (default: ``1``).
+    :param pool: A :class:`dbschema.pool.ConnectionPool`. If given,
+      the connection is drawn from the pool and returned to it by
+      :meth:`~dbschema.objects.Database.close`.
+    :param hook: A :class:`dbschema.instrumentation.Hook` that is
+      called with timings and row counts of queries and refreshes.
+    :param system_namespaces: If ``False`` system namespaces like
+      ``pg_catalog`` or ``mysql`` are excluded (default: ``True``).
+    :param namespaces: List of glob patterns (``*`` and ``?``). If
+      given, only namespaces matching one of them are loaded.
+    :param exclude_namespaces: List of glob patterns of namespaces
+      that are not loaded.
+    :param track_changes: If ``True``
+      :meth:`~dbschema.objects.Database.sync` also notices changes that
+      leave the catalog row of a relation untouched, like renamed
+      columns, changed defaults, constraints and indexes on
+      PostgreSQL and indexes on MySQL. The change tokens are read
+      with an additional catalog query when relations are loaded and
+      on every sync.
+      SQLite always notices these changes (default: ``False``).
     :param connect_kwargs: Connection kwargs if not connection is
       given.
 
     It is an error if both ``connection`` and ``connect_kwargs`` are
     given.
 
+    Namespace filters are applied in the catalog queries, backends
+    without namespaces (SQLite) ignore them.
+
     :returns: A :class:`Schema` instance.
     :raises: :exc:`dbschema.exceptions.DBSchemaError` if things went
       wrong.
     """
     db_cls = backends.get_backend(backend)
-    db = db_cls(backend, log_sql=log_sql)
-    db.set_connection(connection=connection, **connect_kwargs)
-    db._initialize()
+    db = db_cls(backend, log_sql=log_sql, scoped_refresh=scoped_refresh,
+                fetch_size=fetch_size,
+                server_side_cursors=server_side_cursors, itersize=itersize,
+                refresh_workers=refresh_workers,
+                system_namespaces=system_namespaces, namespaces=namespaces,
+                exclude_namespaces=exclude_namespaces,
+                track_changes=track_changes)
+    db.hook = hook
+    db.set_connection(connection=connection, pool=pool, **connect_kwargs)
+    with db._phase('initialize'):
+        db._initialize()
     return db
+
+
+def open_async(backend, connection=None, log_sql=False, scoped_refresh=False,
+               max_connections=2, hook=None, namespaces=None,
+               exclude_namespaces=None, **connect_kwargs):
+    """Returns an awaitable for a :class:`dbschema.aio.AsyncDatabase`.
+
+    Usage::
+
+      adb = await dbschema.open_async('sqlite3', database='example.db')
+      tables = await adb.get_tables()
+
+    Queries run on an asyncio driver (aiosqlite, asyncpg or
+    aiomysql), connection and connect_kwargs are passed to that
+    driver. Independent queries run concurrently on up to
+    max_connections connections. See :func:`open` for the other
+    parameters.
+    """
+    from .aio import open_async as _open_async
+    return _open_async(backend, connection=connection, log_sql=log_sql,
+                       scoped_refresh=scoped_refresh,
+                       max_connections=max_connections, hook=hook,
+                       namespaces=namespaces,
+                       exclude_namespaces=exclude_namespaces,
+                       **connect_kwargs)
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""asyncio interface.
+
+The object tree is the same as with :func:`dbschema.open`, but catalog
+queries run on an asyncio database driver. Queries that don't depend
+on each other, e.g. columns and foreign keys, run concurrently on a
+small number of connections.
+
+Requires Python 3.5 and one of the drivers aiosqlite, asyncpg or
+aiomysql.
+"""
+
+import asyncio
+import importlib
+import re
+from timeit import default_timer as timer
+
+from . import backends
+from . import objects
+from .exceptions import DBSchemaError
+
+
+def _import_driver(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError as err:
+        raise DBSchemaError('Failed to load database module: %s' % err)
+
+
+_PLACEHOLDER = re.compile(r'%(s|%)')
+
+
+def _numeric_params(sql):
+    # asyncpg uses $1, $2, ... instead of the DB-API2 format style.
+    counter = iter(range(1, len(sql) + 1))
+
+    def replace(match):
+        if match.group(1) == '%':
+            return '%'
+        return '$%d' % next(counter)
+    return _PLACEHOLDER.sub(replace, sql)
+
+
+class _Driver(object):
+    """Adapts an asyncio database module."""
+
+    module = None
+
+    def __init__(self):
+        self.dbapi = _import_driver(self.module)
+
+    async def connect(self, **connect_kwargs):
+        raise NotImplementedError('_Driver.connect()')
+
+    async def fetch(self, conn, sql, params):
+        """Returns all rows of a query as a list of tuples."""
+        raise NotImplementedError('_Driver.fetch()')
+
+    async def close(self, conn):
+        await conn.close()
+
+
+class _AiosqliteDriver(_Driver):
+    module = 'aiosqlite'
+
+    async def connect(self, **connect_kwargs):
+        return await self.dbapi.connect(**connect_kwargs)
+
+    async def fetch(self, conn, sql, params):
+        cur = await conn.execute(sql, params or ())
+        try:
+            return [tuple(row) for row in await cur.fetchall()]
+        finally:
+            await cur.close()
+
+
+class _AsyncpgDriver(_Driver):
+    module = 'asyncpg'
+
+    async def connect(self, **connect_kwargs):
+        return await self.dbapi.connect(**connect_kwargs)
+
+    async def fetch(self, conn, sql, params):
+        records = await conn.fetch(_numeric_params(sql), *(params or ()))
+        return [tuple(record) for record in records]
+
+
+class _AiomysqlDriver(_Driver):
+    module = 'aiomysql'
+
+    async def connect(self, **connect_kwargs):
+        return await self.dbapi.connect(**connect_kwargs)
+
+    async def fetch(self, conn, sql, params):
+        cur = await conn.cursor()
+        try:
+            await cur.execute(sql, params)
+            return list(await cur.fetchall())
+        finally:
+            await cur.close()
+
+    async def close(self, conn):
+        conn.close()
+
+
+_DRIVERS = {
+    'mysql': _AiomysqlDriver,
+    'postgresql': _AsyncpgDriver,
+    'sqlite3': _AiosqliteDriver,
+}
+
+
+class AsyncDatabase(object):
+    """Asynchronous access to a database object tree.
+
+    The tree itself is available as :attr:`db`. Navigating it with
+    :meth:`~dbschema.objects.Node.find` and friends never runs
+    queries; use the coroutines of this class to load children.
+
+    :param db: A backend :class:`~dbschema.objects.Database`
+      instance without connection.
+    :param driver: The driver used to run queries.
+    :param connection: If not ``None``, an already opened connection
+      of the driver. Queries are serialized on that connection.
+    :param max_connections: Maximum number of connections opened from
+      connect_kwargs.
+    :param connect_kwargs: Connection kwargs for the driver.
+    """
+
+    def __init__(self, db, driver, connection=None, max_connections=2,
+                 **connect_kwargs):
+        if connection is not None and connect_kwargs:
+            raise DBSchemaError(
+                'Either connection or connect_kwargs is allowed, not both.')
+        #: The :class:`~dbschema.objects.Database` object tree.
+        self.db = db
+        self._driver = driver
+        self._connect_kwargs = connect_kwargs
+        self._idle = []
+        self._own = []
+        if connection is not None:
+            self._idle.append(connection)
+            max_connections = 1
+        elif connect_kwargs.get('database') == ':memory:':
+            # Every connection would open another in-memory database.
+            max_connections = 1
+        self._slots = asyncio.Semaphore(max(max_connections, 1))
+        # Running refreshes, keyed by type or (object, type).
+        self._pending = {}
+
+    async def _acquire(self):
+        await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+        try:
+            conn = await self._driver.connect(**self._connect_kwargs)
+        except Exception as err:
+            self._slots.release()
+            raise DBSchemaError('Could not connect to database: %s' % err)
+        self._own.append(conn)
+        return conn
+
+    def _release(self, conn):
+        self._idle.append(conn)
+        self._slots.release()
+
+    async def _fetch(self, loader):
+        conn = await self._acquire()
+        start = timer()
+        try:
+            rows = await self._driver.fetch(conn, loader.sql, loader.params)
+        finally:
+            self._release(conn)
+        if self.db._log_sql:  # NOQA
+            backends.base.logger.info('SQL: %s [%r]', loader.sql,
+                                      loader.params)
+        if self.db.hook is not None:
+            self.db._record_query(loader.sql, loader.params,
+                                  timer() - start, len(rows))
+        return rows
+
+    async def _run_loaders(self, loaders):
+        # Queries run concurrently, results are merged into the tree
+        # in order, so consume functions see a consistent state.
+        results = await asyncio.gather(
+            *[self._fetch(loader) for loader in loaders])
+        result = None
+        for loader, rows in zip(loaders, results):
+            result = loader.consume(rows)
+        return result
+
+    async def _run_once(self, key, func, *args):
+        # Concurrent callers share a running refresh.
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._pending[key] = task
+
+            def done(_, key=key, task=task):
+                if self._pending.get(key) is task:
+                    del self._pending[key]
+            task.add_done_callback(done)
+        return await task
+
+    async def _initialize(self):
+        with self.db._phase('initialize'):
+            await self._run_loaders(self.db._get_initial_loaders())
+
+    async def close(self):
+        """Closes all connections opened by this instance."""
+        conns, self._own = self._own, []
+        for conn in conns:
+            if conn in self._idle:
+                self._idle.remove(conn)
+            await self._driver.close(conn)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def find(self, *args, **kwargs):
+        """Same as :meth:`dbschema.objects.Node.find` on :attr:`db`."""
+        return self.db.find(*args, **kwargs)
+
+    def find_exact(self, *args, **kwargs):
+        """Same as :meth:`dbschema.objects.Node.find_exact` on :attr:`db`."""
+        return self.db.find_exact(*args, **kwargs)
+
+    def find_by_oid(self, oid):
+        """Same as :meth:`dbschema.objects.Database.find_by_oid`."""
+        return self.db.find_by_oid(oid)
+
+    async def get_default_namespace(self):
+        """Returns the default namespace or None."""
+        db = self.db
+        if db._default_ns_cache is objects.DOESNOTEXIST:
+            loader = db._get_default_namespace_loader()
+            if loader is None:
+                nsp = None
+            else:
+                nsp = await self._run_loaders([loader])
+            db._default_ns_cache = nsp
+        return db._default_ns_cache
+
+    async def _get_types_from_default_ns(self, type_cls):
+        await self._refresh_types_internal([type_cls])
+        nsp = await self.get_default_namespace() or self.db
+        return list(nsp.find(type_cls=type_cls, recurse=False))
+
+    async def get_tables(self):
+        """Returns a list of all tables from the default namespace."""
+        return await self._get_types_from_default_ns(objects.Table)
+
+    async def get_views(self):
+        """Returns a list of all views from the default namespace."""
+        return await self._get_types_from_default_ns(objects.View)
+
+    async def _get_children(self, obj, type_cls):
+        await self._refresh_object_internal(obj, type_cls)
+        return list(obj.find(type_cls=type_cls, recurse=False))
+
+    async def get_columns(self, obj):
+        """Returns the columns of a table or view in ordinal order."""
+        return await self._get_children(obj, objects.Column)
+
+    async def get_foreign_keys(self, table):
+        """Returns the foreign keys of a table."""
+        return await self._get_children(table, objects.ForeignKey)
+
+    async def get_reverse_foreign_keys(self, table):
+        """Returns the foreign keys pointing to a table."""
+        await self._refresh_types_internal([objects.ForeignKey])
+        return list(self.db._fk_idx.get(table, {}).values())
+
+    async def refresh_types(self, type_clss):
+        """Refreshes type_clss concurrently, see
+        :meth:`dbschema.objects.Database.refresh_types`."""
+        await self._run_loaders(self.db._get_refresh_loaders(type_clss))
+
+    async def _phased_refresh_types(self, type_clss):
+        with self.db._phase('refresh_types'):
+            await self.refresh_types(type_clss)
+
+    async def refresh_all(self):
+        """Loads all types and objects that are not loaded yet."""
+        db = self.db
+        await self._refresh_types_internal(
+            db._dirty.union(t for t in db._dirty_objs if db._dirty_objs[t]))
+
+    async def refresh(self, obj, type_cls):
+        """Refreshes the children of obj of a certain type, see
+        :meth:`dbschema.objects.Database.refresh`."""
+        db = self.db
+        if obj is db or type_cls not in db.scoped_types:
+            db.set_dirty(type_cls, True)
+            await self._refresh_types_internal([type_cls])
+            return
+        await self._run_once((obj, type_cls), self._refresh_object,
+                             obj, type_cls)
+
+    async def _refresh_object(self, obj, type_cls):
+        db = self.db
+        loaders = db._get_object_loaders(obj, type_cls)
+        results = await asyncio.gather(
+            *[self._fetch(loader) for loader in loaders])
+        # Children are replaced only when the new rows are there.
+        db._remove_descendants(obj, type_cls)
+        for loader, rows in zip(loaders, results):
+            loader.consume(rows)
+        db.set_dirty(type_cls, False, obj=obj)
+
+    async def _refresh_types_internal(self, type_clss):
+        db = self.db
+        for type_cls in type_clss:
+            # Types that are currently loaded are not dirty anymore.
+            task = self._pending.get(type_cls)
+            if task is not None:
+                await task
+        tbd = db._take_dirty_types(type_clss)
+        if tbd:
+            task = asyncio.ensure_future(self._phased_refresh_types(tbd))
+            for type_cls in tbd:
+                self._pending[type_cls] = task
+            try:
+                await task
+            finally:
+                for type_cls in tbd:
+                    if self._pending.get(type_cls) is task:
+                        del self._pending[type_cls]
+        tasks = []
+        for type_cls in type_clss:
+            for obj in list(db._dirty_objs.get(type_cls, ())):
+                tasks.append(self.refresh(obj, type_cls))
+        await asyncio.gather(*tasks)
+
+    async def _refresh_object_internal(self, obj, type_cls):
+        task = self._pending.get(type_cls)
+        if task is not None:
+            await task
+        scope = self.db._get_refresh_scope(obj, type_cls)
+        if scope == 'type':
+            await self._refresh_types_internal([type_cls])
+        elif scope == 'object':
+            await self.refresh(obj, type_cls)
+
+
+async def open_async(backend, connection=None, log_sql=False,
+                     scoped_refresh=False, max_connections=2, hook=None,
+                     namespaces=None, exclude_namespaces=None,
+                     **connect_kwargs):
+    """Returns an :class:`AsyncDatabase` instance.
+
+    See :func:`dbschema.open` for the parameters.
+
+    :param max_connections: Maximum number of concurrently used
+      connections (default: ``2``). Ignored if connection is given.
+    :raises: :exc:`dbschema.exceptions.DBSchemaError` if things went
+      wrong.
+    """
+    db_cls = backends.get_backend(backend)
+    if backend not in _DRIVERS:
+        raise DBSchemaError('No asyncio driver for backend %r' % backend)
+    driver = _DRIVERS[backend]()
+    db = db_cls(backend, log_sql=log_sql, scoped_refresh=scoped_refresh,
+                namespaces=namespaces, exclude_namespaces=exclude_namespaces)
+    db.hook = hook
+    adb = AsyncDatabase(db, driver, connection=connection,
+                        max_connections=max_connections, **connect_kwargs)
+    try:
+        await adb._initialize()
+    except Exception:
+        await adb.close()
+        raise
+    return adb
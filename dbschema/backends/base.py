@@ -1,36 +1,306 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import threading
+from collections import namedtuple
+from timeit import default_timer as timer
 
-from ..objects import Database
+try:
+    import queue
+except ImportError:  # py2
+    import Queue as queue
+
+from ..exceptions import DBSchemaError
+from ..objects import DOESNOTEXIST, Database
 
 
 logger = logging.getLogger('dbschema')
 
 
+#: A catalog query and the function that merges its result into the
+#: object tree. consume is called with an iterable of result tuples,
+#: large is passed to :meth:`BaseDatabase.iter_query`.
+Loader = namedtuple('Loader', 'sql params consume large')
+
+
 class BaseDatabase(Database):
 
-    def __init__(self, name, log_sql=False):
-        super(BaseDatabase, self).__init__(name)
+    #: Glob patterns of namespaces excluded if system_namespaces is
+    #: ``False``.
+    system_namespace_patterns = ()
+
+    def __init__(self, name, log_sql=False, scoped_refresh=False,
+                 fetch_size=1000, server_side_cursors=False, itersize=2000,
+                 refresh_workers=1, system_namespaces=True, namespaces=None,
+                 exclude_namespaces=None, track_changes=False):
+        super(BaseDatabase, self).__init__(name, scoped_refresh=scoped_refresh)
         self._log_sql = log_sql
+        #: Number of rows fetched from the database at once.
+        self.fetch_size = fetch_size
+        #: If ``True`` large catalog queries use server-side cursors,
+        #: if supported by the backend.
+        self.server_side_cursors = server_side_cursors
+        #: Number of rows fetched at once from server-side cursors.
+        self.itersize = itersize
+        #: Number of connections used to refresh types in parallel.
+        self.refresh_workers = refresh_workers
+        #: If ``False`` system namespaces like ``pg_catalog`` are not
+        #: loaded, if supported by the backend.
+        self.system_namespaces = system_namespaces
+        #: Glob patterns, if given only matching namespaces are loaded.
+        self.namespaces = namespaces
+        #: Glob patterns of namespaces that are not loaded.
+        self.exclude_namespaces = exclude_namespaces
+        #: If ``True`` detailed change tokens are loaded for sync(),
+        #: if supported by the backend.
+        self.track_changes = track_changes
+        self._worker_conns = []
+        # Serializes query statistics of worker threads.
+        self._stats_lock = threading.Lock()
+
+    def get_cursor(self, server_side=False, connection=None):
+        """Returns a new DB-API2 cursor.
+
+        :param server_side: If ``True`` a server-side cursor is
+          requested. Backends without support for server-side cursors
+          return a regular cursor.
+        :param connection: The connection to use, defaults to
+          :attr:`connection`.
+        """
+        if connection is None:
+            connection = self.connection
+        return connection.cursor()
+
+    def iter_query(self, sql, params=None, large=False):
+        """Runs a database query and yields results as tuples.
+
+        Rows are fetched in batches of :attr:`fetch_size` rows. The
+        cursor is closed as soon as the generator is exhausted or
+        closed.
+
+        :param large: Hint that the query may return many rows. If
+          :attr:`server_side_cursors` is enabled those queries run on
+          a server-side cursor and are fetched in batches of
+          :attr:`itersize` rows.
+        """
+        return self._query(sql, params, as_dicts=False, large=large)
+
+    def _run_loaders(self, loaders):
+        """Runs loaders one after another.
+
+        Returns the result of the last consume function.
+        """
+        result = None
+        for loader in loaders:
+            result = loader.consume(self.iter_query(
+                loader.sql, loader.params, large=loader.large))
+        return result
+
+    def _initialize(self):
+        self._run_loaders(self._get_initial_loaders())
+
+    def _get_initial_loaders(self):
+        """Returns loaders that pre-populate the tree, see _initialize()."""
+        return []
+
+    def refresh_types(self, type_clss):
+        loaders = self._get_refresh_loaders(type_clss)
+        if len(loaders) > 1 and self._can_refresh_in_parallel():
+            self._run_loaders_parallel(loaders)
+        else:
+            self._run_loaders(loaders)
+
+    def _can_refresh_in_parallel(self):
+        # Additional connections can only be opened from connect kwargs.
+        return self.refresh_workers > 1 and self._conn_kwargs is not None
+
+    def _connect_worker(self):
+        """Returns a new connection used by refresh worker threads."""
+        return self.dbapi.connect(**self._conn_kwargs)
 
-    def get_cursor(self):
-        """Returns a new DB-API2 cursor."""
-        return self.connection.cursor()
+    def _run_loaders_parallel(self, loaders):
+        """Runs loaders on up to :attr:`refresh_workers` connections.
+
+        The calling thread uses the regular connection, worker threads
+        use additional connections. Once all queries are done the
+        results are merged into the tree by the calling thread, in the
+        order of loaders.
+        """
+        pending = queue.Queue()
+        for i, loader in enumerate(loaders):
+            pending.put((i, loader))
+        results = [None] * len(loaders)
+        errors = []
+
+        def run(fetch):
+            while not errors:
+                try:
+                    i, loader = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[i] = fetch(loader)
+                except Exception as err:
+                    errors.append(err)
+
+        conns = []
+        threads = []
+        try:
+            for _ in range(min(self.refresh_workers, len(loaders)) - 1):
+                conn = self._acquire_worker_connection()
+                conns.append(conn)
+                thread = threading.Thread(
+                    target=run, args=(lambda loader, conn=conn:
+                                      self._fetch_rows(conn, loader),))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            run(lambda loader: list(self.iter_query(
+                loader.sql, loader.params, large=loader.large)))
+        finally:
+            for thread in threads:
+                thread.join()
+            self._worker_conns.extend(conns)
+        if errors:
+            raise errors[0]
+        for loader, rows in zip(loaders, results):
+            loader.consume(rows)
+
+    def close(self):
+        conns, self._worker_conns = self._worker_conns, []
+        for conn in conns:
+            conn.close()
+        super(BaseDatabase, self).close()
+
+    def _acquire_worker_connection(self):
+        if self._worker_conns:
+            return self._worker_conns.pop()
+        try:
+            return self._connect_worker()
+        except Exception as err:
+            raise DBSchemaError('Could not connect to database: %s' % err)
+
+    def _fetch_rows(self, conn, loader):
+        # Runs a loader query on a worker connection.
+        return list(self._query(loader.sql, loader.params, as_dicts=False,
+                                large=loader.large, connection=conn))
+
+    def _get_refresh_loaders(self, type_clss):
+        """Returns loaders refreshing type_clss, see refresh_types().
+
+        The queries must not depend on each other's results, they may
+        run in parallel. The loaders are consumed in order.
+        """
+        return []
+
+    def _refresh_object(self, obj, type_cls):
+        self._run_loaders(self._get_object_loaders(obj, type_cls))
+
+    def _get_object_loaders(self, obj, type_cls):
+        """Returns loaders for children of obj, see _refresh_object()."""
+        raise NotImplementedError('BaseDatabase._get_object_loaders()')
+
+    def get_default_namespace(self):
+        if self._default_ns_cache is DOESNOTEXIST:
+            loader = self._get_default_namespace_loader()
+            if loader is None:
+                nsp = None
+            else:
+                nsp = self._run_loaders([loader])
+            self._default_ns_cache = nsp
+        return self._default_ns_cache
+
+    def _get_default_namespace_loader(self):
+        """Returns a loader resolving the default namespace or None."""
+        return None
+
+    def _namespace_filter(self, column):
+        """Returns a condition and params limiting a query to the
+        namespaces of interest.
+
+        The condition is empty or starts with ``" AND "``, column is
+        the SQL expression for the namespace name. Params are in
+        DB-API2 format style.
+        """
+        conds = []
+        params = []
+        if self.namespaces:
+            conds.append('(%s)' % ' OR '.join(
+                ['%s LIKE %%s' % column] * len(self.namespaces)))
+            params.extend(_glob_to_like(p) for p in self.namespaces)
+        excludes = list(self.exclude_namespaces or ())
+        if not self.system_namespaces:
+            excludes.extend(self.system_namespace_patterns)
+        for pattern in excludes:
+            conds.append('%s NOT LIKE %%s' % column)
+            params.append(_glob_to_like(pattern))
+        if not conds:
+            return '', []
+        return ' AND ' + ' AND '.join(conds), params
 
     def run_query(self, sql, params=None):
         """Runs a database query and yields results as dicts."""
-        cur = self.get_cursor()
-        if params is not None:
-            cur.execute(sql, params)
+        return self._query(sql, params, as_dicts=True)
+
+    def _query(self, sql, params, as_dicts, large=False, connection=None):
+        server_side = large and self.server_side_cursors
+        hook = self.hook
+        if hook is not None:
+            start = timer()
+            count = 0
+        cur = self.get_cursor(server_side=server_side, connection=connection)
+        try:
+            if params is not None:
+                cur.execute(sql, params)
+            else:
+                cur.execute(sql)
+            if self._log_sql:  # NOQA
+                logger.info('SQL: %s [%r]', sql, params)
+            if server_side:
+                # Server-side cursors may lack a description until
+                # the first rows are fetched.
+                size = self.itersize
+                rows = cur.fetchmany(size)
+            else:
+                size = self.fetch_size
+                rows = None
+            if not cur.description:
+                # SQLite3 doesn't have a description when no rows are
+                # returned.
+                return
+            names = [c[0] for c in cur.description]
+            while True:
+                if rows is None:
+                    rows = cur.fetchmany(size)
+                if not rows:
+                    break
+                if hook is not None:
+                    count += len(rows)
+                if as_dicts:
+                    for row in rows:
+                        yield dict(zip(names, row))
+                else:
+                    for row in rows:
+                        yield row
+                rows = None
+        finally:
+            cur.close()
+            if hook is not None:
+                with self._stats_lock:
+                    self._record_query(sql, params, timer() - start, count)
+
+
+def _glob_to_like(pattern):
+    # Translates * and ? to LIKE wildcards, LIKE wildcards in the
+    # pattern are escaped with the default escape character.
+    result = []
+    for char in pattern:
+        if char in '\\%_':
+            result.append('\\' + char)
+        elif char == '*':
+            result.append('%')
+        elif char == '?':
+            result.append('_')
         else:
-            cur.execute(sql)
-        if self._log_sql:  # NOQA
-            logger.info('SQL: %s [%r]', sql, params)
-        if not cur.description:
-            # SQLite3 doesn't have a description when no rows are
-            # returned. Error out here.
-            raise StopIteration
-        names = [c[0] for c in cur.description]
-        for row in cur.fetchall():
-            yield dict(zip(names, row))
+            result.append(char)
+    return ''.join(result)
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
+from functools import partial
+
 from .. import objects
-from .base import BaseDatabase
+from .base import BaseDatabase, Loader
 
 
 class Database(BaseDatabase):
@@ -11,107 +13,333 @@ class Database(BaseDatabase):
             (objects.Table, (
                 (objects.Column, None),
                 (objects.ForeignKey, None),
+                (objects.Index, None),
+                (objects.PrimaryKey, None),
+                (objects.UniqueConstraint, None),
             )),
             (objects.View, (
                 (objects.Column, None),
             )),
         )),
     )
+    scoped_types = (objects.Column, objects.ForeignKey, objects.Index,
+                    objects.PrimaryKey, objects.UniqueConstraint)
+    system_namespace_patterns = ('information_schema', 'mysql',
+                                 'performance_schema', 'sys')
+
+    _relation_tokens = None  # oid -> token, see _iter_relations()
 
     def get_server_info(self):
         return 'MySQL %s' % self.connection.get_server_info()
 
-    def _initialize(self):
-        nsp_map = {}
-        for item in self.run_query(INITIAL_SQL):
-            if item['TYPE'] == 'schema':
-                if item['id'] in nsp_map:
-                    nsp = nsp_map[item['id']]
-                else:
-                    nsp = objects.Namespace(item['name'], oid=item['id'])
-                    self.add_child(nsp)
-                    nsp_map[item['id']] = nsp
-            elif item['TYPE'] in ('SYSTEM VIEW', 'VIEW'):
-                nsp = nsp_map[item['parent']]
-                nsp.add_child(objects.View(
-                    item['name'], description=item['description'],
-                    oid=item['id']))
-            elif item['TYPE'] == 'BASE TABLE':
-                nsp = nsp_map[item['parent']]
-                nsp.add_child(objects.Table(
-                    item['name'], description=item['description'],
-                    oid=item['id']))
-            elif item['TYPE'] == 'column':
-                table = self.find_by_oid(item['parent'])
-                if table is None:
-                    continue
-                table.add_child(objects.Column(
-                    item['name'], description=item['description'],
-                    oid=item['id']))
-        self.db.set_dirty(objects.Table, False)
-        self.db.set_dirty(objects.View, False)
-        self.db.set_dirty(objects.Column, False)
-
-    def get_default_namespace(self):
-        default = list(self.run_query('select database();'))[0]['database()']
+    def _get_initial_loaders(self):
+        return ([self._get_namespaces_loader()]
+                + self._get_relation_loaders((objects.Table, objects.View)))
+
+    def _get_namespaces_loader(self, refresh=False):
+        # Refreshes patch the existing tree like sync(), so references
+        # to unchanged nodes stay valid.
+        where, params = self._namespace_filter('SCHEMA_NAME')
+        if refresh:
+            consume = self._refresh_namespaces
+        else:
+            consume = self._load_namespaces
+        return Loader(SQL_SCHEMATA + where, params or None, consume, False)
+
+    def _iter_namespaces(self, rows):
+        # Yields rows for _sync_nodes(). Schemas can't be altered, they
+        # have no change token.
+        for oid, name in rows:
+            yield (objects.Namespace, oid, None, None, {'name': name})
+
+    def _load_namespaces(self, rows):
+        for oid, name in rows:
+            self.add_child(objects.Namespace(name, oid=oid))
+        self.set_dirty(objects.Namespace, False)
+
+    def _refresh_namespaces(self, rows):
+        self._sync_nodes((objects.Namespace,),
+                         list(self._iter_namespaces(rows)))
+        self.set_dirty(objects.Namespace, False)
+
+    def _get_relation_loaders(self, type_clss, refresh=False):
+        # Detailed change tokens are consumed first and combined with
+        # the relations by _iter_relations(). Only tables have them.
+        loaders = []
+        if self.track_changes and objects.Table in type_clss:
+            loaders.append(self._get_relation_tokens_loader())
+        loaders.append(self._get_relations_loader(type_clss, refresh))
+        return loaders
+
+    def _get_relation_tokens_loader(self):
+        where, params = self._namespace_filter('s.table_schema')
+        sql = SQL_TABLE_TOKENS + where + SQL_TABLE_TOKENS_GROUP_BY
+        return Loader(sql, params or None, self._load_relation_tokens, True)
+
+    def _load_relation_tokens(self, rows):
+        self._relation_tokens = dict(rows)
+
+    def _get_relations_loader(self, type_clss, refresh=False):
+        where, params = self._namespace_filter('t.table_schema')
+        table_types = []
+        if objects.Table in type_clss:
+            table_types.append("'BASE TABLE'")
+        if objects.View in type_clss:
+            table_types.extend(["'VIEW'", "'SYSTEM VIEW'"])
+        sql = (SQL_TABLES
+               + ' AND t.table_type IN (%s)' % ', '.join(table_types)
+               + where)
+        if refresh:
+            consume = partial(self._refresh_relations, type_clss)
+        else:
+            consume = partial(self._load_relations, type_clss)
+        return Loader(sql, params or None, consume, True)
+
+    def _iter_relations(self, rows):
+        # Yields rows for _sync_nodes(). ALTER TABLE recreates the
+        # table, so the creation time serves as change token. Views
+        # have no creation time, their definition is used instead.
+        # Indexes can be changed in place, if track_changes is enabled
+        # a checksum of the table's rows in statistics is added.
+        tokens, self._relation_tokens = self._relation_tokens, None
+        for (oid, name, description, objtype, parent,
+             token) in rows:
+            if objtype == 'BASE TABLE':
+                klass = objects.Table
+            elif objtype in ('SYSTEM VIEW', 'VIEW'):
+                klass = objects.View
+            else:
+                continue
+            if tokens is not None:
+                token = (token, tokens.get(oid))
+            yield (klass, oid, parent, token,
+                   {'name': name, 'description': description})
+
+    def _load_relations(self, type_clss, rows):
+        for klass, oid, parent, token, attrs in self._iter_relations(rows):
+            nsp = self.find_by_oid(parent)
+            if nsp is None:
+                continue
+            nsp.add_child(klass(oid=oid, **attrs))
+            self._sync_tokens[oid] = token
+        for type_cls in type_clss:
+            self.set_dirty(type_cls, False)
+
+    def _refresh_relations(self, type_clss, rows):
+        self._sync_nodes(type_clss, list(self._iter_relations(rows)))
+        for type_cls in type_clss:
+            self.set_dirty(type_cls, False)
+
+    def _get_default_namespace_loader(self):
+        return Loader('select database();', None,
+                      self._load_default_namespace, False)
+
+    def _load_default_namespace(self, rows):
+        default = list(rows)[0][0]
         if default is not None:
-            return self.find_exact(type_cls=objects.Namespace, oid=default)
+            # Namespace oids are lower case, see SQL_SCHEMATA.
+            return self.find_by_oid(default.lower())
+
+    def sync(self):
+        loader = self._get_namespaces_loader()
+        rows = list(self._iter_namespaces(
+            self.iter_query(loader.sql, loader.params)))
+        if self.track_changes:
+            loader = self._get_relation_tokens_loader()
+            loader.consume(
+                self.iter_query(loader.sql, loader.params, large=True))
+        loader = self._get_relations_loader((objects.Table, objects.View))
+        rows.extend(self._iter_relations(
+            self.iter_query(loader.sql, loader.params, large=True)))
+        return self._sync_nodes(
+            (objects.Namespace, objects.Table, objects.View), rows)
 
-    def refresh(self, obj, type_cls):
-        if type_cls == objects.ForeignKey:
-            self._refresh_constraints(obj)
+    def _get_object_loaders(self, obj, type_cls):
+        if type_cls == objects.Column:
+            return [self._get_columns_loader(obj)]
+        elif type_cls == objects.ForeignKey:
+            return [self._get_constraints_loader(obj)]
+        elif type_cls in KEY_TYPES:
+            return [self._get_keys_loader([type_cls], obj)]
+        return []
 
-    def refresh_types(self, type_clss):
+    def _get_refresh_loaders(self, type_clss):
+        loaders = []
+        if objects.Namespace in type_clss:
+            loaders.append(self._get_namespaces_loader(refresh=True))
+        relation_types = [t for t in (objects.Table, objects.View)
+                          if t in type_clss]
+        if relation_types:
+            loaders.extend(self._get_relation_loaders(tuple(relation_types),
+                                                      refresh=True))
+        if objects.Column in type_clss:
+            loaders.append(self._get_columns_loader())
         if objects.ForeignKey in type_clss:
-            self._refresh_constraints()
+            loaders.append(self._get_constraints_loader())
+        key_types = [t for t in KEY_TYPES if t in type_clss]
+        if key_types:
+            loaders.append(self._get_keys_loader(key_types))
+        return loaders
+
+    def _scope_filter(self, obj, alias):
+        # Returns a condition and params to limit a query to obj and
+        # the namespaces of interest.
+        where, params = self._namespace_filter('%s.table_schema' % alias)
+        if isinstance(obj, objects.Namespace):
+            where += ' AND %s.table_schema = %%s' % alias
+            params.append(obj.name)
+        elif obj is not None:
+            where += (' AND %s.table_schema = %%s AND %s.table_name = %%s'
+                      % (alias, alias))
+            params.extend([obj.parent.name, obj.name])
+        return where, params or None
+
+    def _get_columns_loader(self, obj=None):
+        where, params = self._scope_filter(obj, 'c')
+        sql = SQL_COLUMNS + where + SQL_COLUMNS_ORDER_BY
+        return Loader(sql, params, self._load_columns, True)
 
-    def _refresh_constraints(self):
-        for item in self.run_query(SQL_FKS):
-            table = self.db.find_by_oid(item['tableoid'])
-            ftable = self.db.find_by_oid(item['refoid'])
+    def _load_columns(self, rows):
+        for (oid, name, description, parent, data_type, nullable, default,
+             position) in rows:
+            table = self.find_by_oid(parent)
+            if table is None:
+                continue
+            table.add_child(objects.Column(
+                name, description=description, oid=oid, data_type=data_type,
+                nullable=nullable == 'YES', default=default,
+                position=position))
+
+    def _get_constraints_loader(self, obj=None):
+        where, params = self._scope_filter(obj, 'kc')
+        sql = SQL_FKS + where + SQL_FKS_GROUP_BY
+        return Loader(sql, params, self._load_constraints, True)
+
+    def _load_constraints(self, rows):
+        for (oid, constraint_name, tableoid, refoid, columns,
+             refcolumns) in rows:
+            table = self.db.find_by_oid(tableoid)
+            if table is None:
+                continue
+            ftable = self.db.find_by_oid(refoid)
             table.add_child(objects.ForeignKey(
-                item['constraint_name'], oid=item['oid'],
-                foreign_table=ftable))
-
-
-INITIAL_SQL = """
-SELECT *
-FROM
-  (SELECT lower(SCHEMA_NAME) AS id,
-          SCHEMA_NAME AS name,
-          NULL AS description,
-          'schema' AS TYPE,
-          NULL AS parent,
-          0 AS pos
-   FROM information_schema.schemata
-   UNION SELECT lower(concat(table_schema, '.', TABLE_NAME)) AS id,
-                TABLE_NAME AS name,
-                table_comment AS description,
-                table_type AS TYPE,
-                lower(table_schema) AS parent,
-                1 AS pos
-   FROM information_schema.tables
-   UNION SELECT lower(concat(table_schema, '.', TABLE_NAME, '.', COLUMN_NAME)) AS id,
-                COLUMN_NAME AS name,
-                column_comment AS description,
-                'column' AS TYPE,
-                lower(concat(table_schema, '.', TABLE_NAME)) AS parent,
-                3 AS pos
-   FROM information_schema.columns) x
-ORDER BY pos ASC
+                constraint_name, oid=oid, foreign_table=ftable,
+                columns=tuple(columns.split(',')),
+                foreign_columns=tuple(refcolumns.split(','))))
+
+    def _get_keys_loader(self, type_clss, obj=None):
+        # Primary keys and unique constraints are indexes in MySQL, one
+        # query on statistics loads all of them.
+        where, params = self._scope_filter(obj, 's')
+        sql = SQL_INDEXES + where + SQL_INDEXES_GROUP_BY
+        return Loader(sql, params, partial(self._load_keys, type_clss),
+                      True)
+
+    def _load_keys(self, type_clss, rows):
+        for tableoid, name, unique, columns in rows:
+            table = self.db.find_by_oid(tableoid)
+            if table is None:
+                continue
+            # Expression parts of an index have no column name.
+            columns = tuple(columns.split(',')) if columns else ()
+            if objects.Index in type_clss:
+                table.add_child(objects.Index(
+                    name, oid='%s#index/%s' % (tableoid, name.lower()),
+                    columns=columns, unique=bool(unique)))
+            if name == 'PRIMARY':
+                if objects.PrimaryKey in type_clss:
+                    table.add_child(objects.PrimaryKey(
+                        name, oid='%s#pk' % tableoid, columns=columns))
+            elif unique and objects.UniqueConstraint in type_clss:
+                table.add_child(objects.UniqueConstraint(
+                    name, oid='%s#unique/%s' % (tableoid, name.lower()),
+                    columns=columns))
+
+
+#: Types loaded from information_schema.statistics.
+KEY_TYPES = (objects.Index, objects.PrimaryKey, objects.UniqueConstraint)
+
+# One row per index, non_unique is the same for all of its columns.
+SQL_INDEXES = """
+SELECT lower(concat(s.table_schema, '.', s.table_name)) AS tableoid,
+       s.index_name,
+       min(s.non_unique) = 0 AS is_unique,
+       group_concat(s.column_name ORDER BY s.seq_in_index SEPARATOR ',') AS columns
+FROM information_schema.statistics s
+WHERE 1 = 1"""
+
+SQL_INDEXES_GROUP_BY = """
+GROUP BY s.table_schema,
+         s.table_name,
+         s.index_name
 """
 
+# Foreign key columns are the rows of key_column_usage referencing
+# another table. Oids are lower case like in SQL_TABLES, the #fk/
+# marker keeps them apart from the oid of a table with the same name.
 SQL_FKS = """
-SELECT concat(tc.constraint_schema, '.', tc.constraint_name) AS oid,
-       tc.constraint_type, tc.constraint_name,
-       concat(tc.table_schema, '.', tc.table_name) AS tableoid,
-       group_concat(kc.column_name, ',') AS columns,
-       concat(kc.referenced_table_schema, '.', kc.referenced_table_name) AS refoid,
-       group_concat(kc.referenced_column_name, ',') AS refcolumns
-FROM information_schema.table_constraints tc
-LEFT JOIN information_schema.key_column_usage kc ON kc.constraint_schema = tc.constraint_schema
-AND kc.constraint_name = tc.constraint_name
-WHERE tc.constraint_type = 'FOREIGN KEY'
-GROUP BY kc.column_name,
-         kc.referenced_column_name;
+SELECT lower(concat(kc.constraint_schema, '#fk/', kc.constraint_name)) AS oid,
+       kc.constraint_name,
+       lower(concat(kc.table_schema, '.', kc.table_name)) AS tableoid,
+       lower(concat(kc.referenced_table_schema, '.', kc.referenced_table_name)) AS refoid,
+       group_concat(kc.column_name ORDER BY kc.ordinal_position SEPARATOR ',') AS columns,
+       group_concat(kc.referenced_column_name ORDER BY kc.ordinal_position SEPARATOR ',') AS refcolumns
+FROM information_schema.key_column_usage kc
+WHERE kc.referenced_table_name IS NOT NULL"""
+
+SQL_FKS_GROUP_BY = """
+GROUP BY kc.constraint_schema,
+         kc.constraint_name,
+         kc.table_schema,
+         kc.table_name,
+         kc.referenced_table_schema,
+         kc.referenced_table_name
+"""
+
+SQL_COLUMNS = """
+SELECT lower(concat(c.table_schema, '.', c.table_name, '.', c.column_name)) AS id,
+       c.column_name AS name,
+       c.column_comment AS description,
+       lower(concat(c.table_schema, '.', c.table_name)) AS parent,
+       c.column_type,
+       c.is_nullable,
+       c.column_default,
+       c.ordinal_position
+FROM information_schema.columns c
+WHERE 1 = 1"""
+
+SQL_COLUMNS_ORDER_BY = """
+ORDER BY c.table_schema,
+         c.table_name,
+         c.ordinal_position
+"""
+
+SQL_SCHEMATA = """
+SELECT lower(SCHEMA_NAME) AS id,
+       SCHEMA_NAME AS name
+FROM information_schema.schemata
+WHERE 1 = 1"""
+
+SQL_TABLES = """
+SELECT lower(concat(t.table_schema, '.', t.table_name)) AS id,
+       t.table_name AS name,
+       t.table_comment AS description,
+       t.table_type AS TYPE,
+       lower(t.table_schema) AS parent,
+       coalesce(cast(t.create_time AS char), md5(v.view_definition)) AS token
+FROM information_schema.tables t
+LEFT JOIN information_schema.views v ON v.table_schema = t.table_schema
+AND v.table_name = t.table_name
+WHERE 1 = 1"""
+
+# A checksum of the index rows of each table, see track_changes.
+SQL_TABLE_TOKENS = """
+SELECT lower(concat(s.table_schema, '.', s.table_name)) AS id,
+       concat(count(*), '/', sum(crc32(concat_ws('/', s.index_name, s.non_unique, s.seq_in_index, s.column_name)))) AS token
+FROM information_schema.statistics s
+WHERE 1 = 1"""
+
+SQL_TABLE_TOKENS_GROUP_BY = """
+GROUP BY s.table_schema,
+         s.table_name
 """
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import itertools
+from functools import partial
+
 from .. import objects
-from .base import BaseDatabase
+from .base import BaseDatabase, Loader
 
 
 class Database(BaseDatabase):
@@ -11,141 +14,355 @@ class Database(BaseDatabase):
             (objects.Table, (
                 (objects.Column, None),
                 (objects.ForeignKey, None),
+                (objects.Index, None),
+                (objects.PrimaryKey, None),
+                (objects.UniqueConstraint, None),
             )),
             (objects.View, (
                 (objects.Column, None),
             )),
         )),
     )
+    scoped_types = (objects.Column, objects.ForeignKey, objects.Index,
+                    objects.PrimaryKey, objects.UniqueConstraint)
+    system_namespace_patterns = ('pg_catalog', 'information_schema',
+                                 'pg_toast*', 'pg_temp_*')
+
+    _cursor_ids = itertools.count()
+    _relation_tokens = None  # oid -> token, see _iter_relations()
+
+    def get_cursor(self, server_side=False, connection=None):
+        conn = self.connection if connection is None else connection
+        if not server_side:
+            return conn.cursor()
+        # Named cursors are server-side cursors in psycopg2.
+        name = 'dbschema_%d' % next(self._cursor_ids)
+        # Without a transaction the cursor needs to outlive the commit.
+        cur = conn.cursor(name, withhold=bool(conn.autocommit))
+        cur.itersize = self.itersize
+        return cur
 
     def get_server_info(self):
         result = list(self.run_query('select version()'))[0]
         return result['version']
 
-    def _initialize(self):
-        nsp_map = {}
-        for item in self.run_query(PG_INITIAL_SQL):
-            if item['nspoid'] is not None:
-                if item['nspoid'] not in nsp_map:
-                    nsp = objects.Namespace(
-                        item['nspname'], oid=item['nspoid'])
-                    self.add_child(nsp)
-                    nsp_map[item['nspoid']] = nsp
-                else:
-                    nsp = nsp_map[item['nspoid']]
-            else:
-                nsp = None
-            if item['objtype'] == 'table':
-                nsp.add_child(objects.Table(
-                    item['relname'], description=item['description'],
-                    oid=item['reloid']))
-            elif item['objtype'] == 'view':
-                nsp.add_child(objects.View(
-                    item['relname'], description=item['description'],
-                    oid=item['reloid']))
+    def _get_initial_loaders(self):
+        return ([self._get_namespaces_loader()]
+                + self._get_relation_loaders(('r', 'v')))
+
+    def _get_namespaces_loader(self, refresh=False):
+        # Refreshes patch the existing tree like sync(), so references
+        # to unchanged nodes stay valid.
+        where, params = self._namespace_filter('nsp.nspname')
+        if refresh:
+            consume = self._refresh_namespaces
+        else:
+            consume = self._load_namespaces
+        return Loader(PG_NAMESPACES_SQL + where, params or None, consume,
+                      False)
+
+    def _iter_namespaces(self, rows):
+        # Yields rows for _sync_nodes().
+        for oid, name, token in rows:
+            yield (objects.Namespace, oid, None, token, {'name': name})
+
+    def _load_namespaces(self, rows):
+        for oid, name, token in rows:
+            self.add_child(objects.Namespace(name, oid=oid))
+            self._sync_tokens[oid] = token
         self.set_dirty(objects.Namespace, False)
-        self.set_dirty(objects.Table, False)
-        self.set_dirty(objects.View, False)
 
-    def get_default_namespace(self):
-        search_path = list(
-            self.run_query('show search_path'))[0]['search_path']
+    def _refresh_namespaces(self, rows):
+        self._sync_nodes((objects.Namespace,),
+                         list(self._iter_namespaces(rows)))
+        self.set_dirty(objects.Namespace, False)
+
+    def _get_relation_loaders(self, relkinds, refresh=False):
+        # Detailed change tokens are consumed first and combined with
+        # the relations by _iter_relations().
+        loaders = []
+        if self.track_changes:
+            loaders.append(self._get_relation_tokens_loader(relkinds))
+        loaders.append(self._get_relations_loader(relkinds, refresh))
+        return loaders
+
+    def _get_relation_tokens_loader(self, relkinds):
+        where, params = self._namespace_filter('nsp.nspname')
+        sql = (PG_RELATION_TOKENS_SQL
+               + ' AND rel.relkind IN (%s)' % ', '.join(
+                   "'%s'" % kind for kind in relkinds)
+               + where)
+        return Loader(sql, params or None, self._load_relation_tokens, True)
+
+    def _load_relation_tokens(self, rows):
+        self._relation_tokens = dict(rows)
+
+    def _get_relations_loader(self, relkinds, refresh=False):
+        where, params = self._namespace_filter('nsp.nspname')
+        sql = (PG_RELATIONS_SQL
+               + ' AND rel.relkind IN (%s)' % ', '.join(
+                   "'%s'" % kind for kind in relkinds)
+               + where)
+        if refresh:
+            consume = partial(self._refresh_relations, relkinds)
+        else:
+            consume = partial(self._load_relations, relkinds)
+        return Loader(sql, params or None, consume, True)
+
+    def _iter_relations(self, rows):
+        # Yields rows for _sync_nodes(). The row version (xmin) of the
+        # pg_class row serves as change token. Some DDL, e.g. renaming
+        # columns or changing defaults, constraints or indexes, only
+        # creates new row versions in pg_attribute, pg_attrdef,
+        # pg_constraint or pg_index. Their row versions are added if
+        # track_changes is enabled. Comments (pg_description) are not
+        # covered.
+        tokens, self._relation_tokens = self._relation_tokens, None
+        for oid, nspoid, name, description, relkind, token in rows:
+            klass = objects.Table if relkind == 'r' else objects.View
+            if tokens is not None:
+                token = (token, tokens.get(oid))
+            yield (klass, oid, nspoid, token,
+                   {'name': name, 'description': description})
+
+    def _load_relations(self, relkinds, rows):
+        for klass, oid, nspoid, token, attrs in self._iter_relations(rows):
+            nsp = self.find_by_oid(nspoid)
+            if nsp is None:
+                continue
+            nsp.add_child(klass(oid=oid, **attrs))
+            self._sync_tokens[oid] = token
+        for type_cls in _get_relation_types(relkinds):
+            self.set_dirty(type_cls, False)
+
+    def _refresh_relations(self, relkinds, rows):
+        type_clss = _get_relation_types(relkinds)
+        self._sync_nodes(type_clss, list(self._iter_relations(rows)))
+        for type_cls in type_clss:
+            self.set_dirty(type_cls, False)
+
+    def _get_default_namespace_loader(self):
+        return Loader("select current_setting('search_path'), current_user",
+                      None, self._load_default_namespace, False)
+
+    def _load_default_namespace(self, rows):
+        search_path, current_user = list(rows)[0]
         for path in search_path.split(','):
+            path = path.strip()
             if path == '"$user"':
-                path = list(self.run_query('select current_user'))[0]['current_user']
+                path = current_user
+            elif path.startswith('"') and path.endswith('"'):
+                path = path[1:-1].replace('""', '"')
             nsp = self.find_exact(type_cls=objects.Namespace, name=path)
             if nsp is not None:
                 return nsp
 
-    def refresh_types(self, type_clss):
+    def sync(self):
+        loader = self._get_namespaces_loader()
+        rows = list(self._iter_namespaces(
+            self.iter_query(loader.sql, loader.params)))
+        if self.track_changes:
+            loader = self._get_relation_tokens_loader(('r', 'v'))
+            loader.consume(
+                self.iter_query(loader.sql, loader.params, large=True))
+        loader = self._get_relations_loader(('r', 'v'))
+        rows.extend(self._iter_relations(
+            self.iter_query(loader.sql, loader.params, large=True)))
+        return self._sync_nodes(
+            (objects.Namespace, objects.Table, objects.View), rows)
+
+    def _get_refresh_loaders(self, type_clss):
+        loaders = []
+        if objects.Namespace in type_clss:
+            loaders.append(self._get_namespaces_loader(refresh=True))
+        relkinds = []
+        if objects.Table in type_clss:
+            relkinds.append('r')
+        if objects.View in type_clss:
+            relkinds.append('v')
+        if relkinds:
+            loaders.extend(self._get_relation_loaders(tuple(relkinds),
+                                                      refresh=True))
         if objects.Column in type_clss:
-            self._refresh_columns()
-        if objects.ForeignKey in type_clss:
-            self._refresh_constraints()
+            loaders.append(self._get_columns_loader())
+        constraint_types = [t for t in CONSTRAINT_TYPES if t in type_clss]
+        if constraint_types:
+            loaders.append(self._get_constraints_loader(constraint_types))
+        if objects.Index in type_clss:
+            loaders.append(self._get_indexes_loader())
+        return loaders
+
+    def _get_object_loaders(self, obj, type_cls):
+        if isinstance(obj, objects.Namespace):
+            where = 'rel.relnamespace = %s'
+        else:
+            where = 'rel.oid = %s'
+        if type_cls == objects.Column:
+            return [self._get_columns_loader(where, [obj.oid])]
+        elif type_cls in CONSTRAINT_TYPES:
+            return [self._get_constraints_loader([type_cls], where,
+                                                 [obj.oid])]
+        elif type_cls == objects.Index:
+            return [self._get_indexes_loader(where, [obj.oid])]
+        return []
 
-    def _refresh_constraints(self):
-        # TODO(andi) Only FK constraints are currently recognized
+    def _add_filters(self, sql, where, params):
+        # Appends a condition and the namespace filter to a query
+        # ending with a where clause.
+        params = list(params or ())
+        if where is not None:
+            sql += ' and %s' % where
+        nsp_where, nsp_params = self._namespace_filter('nsp.nspname')
+        return sql + nsp_where, (params + nsp_params) or None
+
+    def _get_constraints_loader(self, type_clss, where=None, params=None):
+        # TODO(andi) Check and exclusion constraints are not recognized
         sql = ("select con.oid, con.contype, con.conname,"
-               " con.conrelid, con.confrelid, dsc.description"
+               " con.conrelid, con.confrelid, dsc.description,"
+               " " + _PG_KEY_COLUMNS % ('conkey', 'conrelid') + ","
+               " " + _PG_KEY_COLUMNS % ('confkey', 'confrelid') +
                " from pg_constraint con"
-               " left join pg_description dsc on dsc.objoid = con.oid")
-        for item in self.run_query(sql):
-            if item['contype'] == 'f':
-                ftable = self.db.find_by_oid(item['confrelid'])
-                table = self.db.find_by_oid(item['conrelid'])
+               " join pg_class rel on rel.oid = con.conrelid"
+               " join pg_namespace nsp on nsp.oid = rel.relnamespace"
+               " left join pg_description dsc on dsc.objoid = con.oid"
+               " where con.contype in (%s)" % ', '.join(
+                   "'%s'" % contype for contype in sorted(
+                       CONSTRAINT_TYPES[t] for t in type_clss)))
+        sql, params = self._add_filters(sql, where, params)
+        return Loader(sql, params, self._load_constraints, True)
+
+    def _load_constraints(self, rows):
+        for (oid, contype, conname, conrelid, confrelid, description,
+             columns, foreign_columns) in rows:
+            table = self.db.find_by_oid(conrelid)
+            if table is None:
+                continue
+            if contype == 'f':
+                ftable = self.db.find_by_oid(confrelid)
                 table.add_child(objects.ForeignKey(
-                    item['conname'], description=item['description'],
-                    oid=item['oid'], foreign_table=ftable))
+                    conname, description=description, oid=oid,
+                    foreign_table=ftable, columns=tuple(columns or ()),
+                    foreign_columns=tuple(foreign_columns or ())))
+            else:
+                klass = (objects.PrimaryKey if contype == 'p'
+                         else objects.UniqueConstraint)
+                table.add_child(klass(
+                    conname, description=description, oid=oid,
+                    columns=tuple(columns or ())))
+
+    def _get_indexes_loader(self, where=None, params=None):
+        # Expression columns have no name and are skipped.
+        sql = ("select idx.indexrelid, idx.indrelid, cls.relname,"
+               " idx.indisunique, dsc.description,"
+               " array(select a.attname"
+               "  from unnest(idx.indkey::int2[]) with ordinality k(attnum, i)"
+               "  join pg_attribute a on a.attrelid = idx.indrelid"
+               "   and a.attnum = k.attnum order by k.i)"
+               " from pg_index idx"
+               " join pg_class cls on cls.oid = idx.indexrelid"
+               " join pg_class rel on rel.oid = idx.indrelid"
+               " join pg_namespace nsp on nsp.oid = rel.relnamespace"
+               " left join pg_description dsc on dsc.objoid = idx.indexrelid"
+               "  and dsc.objsubid = 0"
+               " where true")
+        sql, params = self._add_filters(sql, where, params)
+        return Loader(sql, params, self._load_indexes, True)
+
+    def _load_indexes(self, rows):
+        for oid, relid, name, unique, description, columns in rows:
+            table = self.db.find_by_oid(relid)
+            if table is None:
+                continue
+            table.add_child(objects.Index(
+                name, description=description, oid=oid,
+                columns=tuple(columns or ()), unique=unique))
 
-    def _refresh_columns(self):
+    def _get_columns_loader(self, where=None, params=None):
         # TODO(andi) columns for relkind 'i' and 'S' still missing
-        sql = ("select att.attrelid, att.attnum, att.attname, dsc.description"
+        sql = ("select att.attrelid, att.attnum, att.attname, dsc.description,"
+               " format_type(att.atttypid, att.atttypmod),"
+               " not att.attnotnull, pg_get_expr(def.adbin, def.adrelid)"
                " from pg_attribute att"
                " join pg_class rel on rel.oid = att.attrelid "
                "   and rel.relkind in ('r', 'v')"
+               " join pg_namespace nsp on nsp.oid = rel.relnamespace"
                " left join pg_description dsc on dsc.objoid = att.attrelid"
                "  and dsc.objsubid = att.attnum"
-               " where att.attnum >= 1")
-        for item in self.run_query(sql):
-            obj = self.db.find_by_oid(item['attrelid'])
+               " left join pg_attrdef def on def.adrelid = att.attrelid"
+               "  and def.adnum = att.attnum"
+               " where att.attnum >= 1 and not att.attisdropped")
+        sql, params = self._add_filters(sql, where, params)
+        sql += ' order by att.attrelid, att.attnum'
+        return Loader(sql, params, self._load_columns, True)
+
+    def _load_columns(self, rows):
+        for (attrelid, attnum, attname, description, data_type, nullable,
+             default) in rows:
+            obj = self.db.find_by_oid(attrelid)
             if obj is None:
-                print(item)
+                continue
             obj.add_child(objects.Column(
-                item['attname'], description=item['description'],
-                oid='%s-%s' % (obj.oid, item['attname'])))
+                attname, description=description,
+                oid='%s-%s' % (obj.oid, attname), data_type=data_type,
+                nullable=nullable, default=default, position=attnum))
+
+
+def _get_relation_types(relkinds):
+    return tuple(objects.Table if kind == 'r' else objects.View
+                 for kind in relkinds)
+
+
+#: Constraint types loaded from pg_constraint and their contype.
+CONSTRAINT_TYPES = {
+    objects.ForeignKey: 'f',
+    objects.PrimaryKey: 'p',
+    objects.UniqueConstraint: 'u',
+}
 
+# Names of the columns in a pg_constraint key array, in key order.
+_PG_KEY_COLUMNS = (
+    "array(select a.attname"
+    " from unnest(con.%s) with ordinality k(attnum, i)"
+    " join pg_attribute a on a.attrelid = con.%s and a.attnum = k.attnum"
+    " order by k.i)")
 
-PG_INITIAL_SQL = """
-SELECT nsp.oid AS nspoid,
+PG_NAMESPACES_SQL = """
+SELECT nsp.oid,
        nsp.nspname,
-       rel.oid AS reloid,
+       nsp.xmin::text AS token
+FROM pg_namespace nsp
+WHERE TRUE"""
+
+PG_RELATIONS_SQL = """
+SELECT rel.oid,
+       rel.relnamespace,
        rel.relname,
        des.description,
-       CASE
-           WHEN rel.relkind = 'r' THEN 'table'
-           WHEN rel.relkind = 'i' THEN 'index'
-           WHEN rel.relkind = 'S' THEN 'sequence'
-           WHEN rel.relkind = 'v' THEN 'view'
-           -- somehow this is required, otherwise the above fails
-           ELSE rel.relkind::char
-
-       END AS objtype --        rel.*
-
+       rel.relkind::text,
+       rel.xmin::text AS token
 FROM pg_class rel
+JOIN pg_namespace nsp ON nsp.oid = rel.relnamespace
 LEFT JOIN pg_description des ON des.objoid = rel.oid
 AND des.objsubid = 0
-LEFT JOIN pg_namespace nsp ON nsp.oid = rel.relnamespace
-WHERE rel.relkind IN ('v',
-                      'r',
-                      'S')
-UNION -- languages
-
-SELECT NULL,
-       NULL,
-       lan.oid,
-       lan.lanname,
-       des.description,
-       'language'
-FROM pg_language lan
-LEFT JOIN pg_description des ON des.objoid = lan.oid
-UNION -- users
-
-SELECT NULL,
-       NULL,
-       use.usesysid,
-       use.usename,
-       NULL,
-       'user'
-FROM pg_user use
-UNION -- functions
+WHERE TRUE"""
 
-SELECT nsp.oid,
-       nsp.nspname,
-       pro.oid,
-       pro.proname,
-       des.description,
-       'function'
-FROM pg_proc pro
-LEFT JOIN pg_namespace nsp ON nsp.oid = pro.pronamespace
-LEFT JOIN pg_description des ON des.objoid = pro.oid
-"""
+PG_RELATION_TOKENS_SQL = """
+SELECT rel.oid,
+       md5(concat_ws(':',
+           (SELECT string_agg(att.xmin::text, ',' ORDER BY att.attnum)
+            FROM pg_attribute att
+            WHERE att.attrelid = rel.oid),
+           (SELECT string_agg(def.xmin::text, ',' ORDER BY def.adnum)
+            FROM pg_attrdef def
+            WHERE def.adrelid = rel.oid),
+           (SELECT string_agg(con.xmin::text, ',' ORDER BY con.oid)
+            FROM pg_constraint con
+            WHERE con.conrelid = rel.oid),
+           (SELECT string_agg(idx.xmin || '/' || ic.xmin, ','
+                              ORDER BY idx.indexrelid)
+            FROM pg_index idx
+            JOIN pg_class ic ON ic.oid = idx.indexrelid
+            WHERE idx.indrelid = rel.oid))) AS token
+FROM pg_class rel
+JOIN pg_namespace nsp ON nsp.oid = rel.relnamespace
+WHERE TRUE"""
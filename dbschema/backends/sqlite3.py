@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from itertools import chain
+from functools import partial
+from itertools import chain, groupby
 
 from .. import objects
-from .base import BaseDatabase
+from .base import BaseDatabase, Loader
 
 
 class Database(BaseDatabase):
@@ -12,50 +13,302 @@ class Database(BaseDatabase):
         (objects.Table, (
             (objects.Column, None),
             (objects.ForeignKey, None),
+            (objects.Index, None),
+            (objects.PrimaryKey, None),
+            (objects.UniqueConstraint, None),
         )),
         (objects.View, (
             (objects.Column, None),
         )),
     )
 
+    scoped_types = (objects.Column, objects.ForeignKey, objects.Index,
+                    objects.PrimaryKey, objects.UniqueConstraint)
+
+    _pragma_functions = None  # detected on first use
+    _schema_version = None
+    _index_names = None  # table name -> index names, see _iter_relations()
+
     def get_server_info(self):
         return 'SQLite %s' % self.dbapi.sqlite_version
 
-    def _initialize(self):
-        sql = 'select type, name, tbl_name, sql from sqlite_master'
-        for item in self.run_query(sql):
-            if item['type'] == 'table':
+    def _can_refresh_in_parallel(self):
+        # Another connection would open another in-memory database.
+        return (super(Database, self)._can_refresh_in_parallel()
+                and self._conn_kwargs.get('database') != ':memory:')
+
+    def _connect_worker(self):
+        # Worker connections are opened here and used in worker threads.
+        kwargs = dict(self._conn_kwargs, check_same_thread=False)
+        return self.dbapi.connect(**kwargs)
+
+    def _get_initial_loaders(self):
+        return [
+            Loader('pragma schema_version', None,
+                   self._load_schema_version, False),
+            Loader(SQL_RELATIONS, None, self._load_relations, False),
+        ]
+
+    def _load_schema_version(self, rows):
+        self._schema_version = list(rows)[0][0]
+
+    def _load_relations(self, rows):
+        for klass, oid, _, token, attrs in self._iter_relations(rows):
+            self.add_child(klass(oid=oid, **attrs))
+            self._sync_tokens[oid] = token
+        self.set_dirty(objects.Table, False)
+        self.set_dirty(objects.View, False)
+
+    def _iter_relations(self, rows):
+        # Yields rows for _sync_nodes(). The create statements of a
+        # relation and of its indexes serve as change token. Index
+        # names are recorded for the index loaders of SQLite versions
+        # without pragma functions.
+        rows = list(rows)
+        indexes = {}
+        for objtype, name, createstatement, tbl_name in rows:
+            if objtype == 'index':
+                indexes.setdefault(tbl_name, []).append(
+                    (name, createstatement))
+        self._index_names = dict(
+            (tbl, [name for name, _ in items])
+            for tbl, items in indexes.items())
+        for objtype, name, createstatement, _ in rows:
+            if objtype == 'table':
                 klass = objects.Table
-            elif item['type'] == 'view':
+            elif objtype == 'view':
                 klass = objects.View
             else:
                 continue
-            self.add_child(
-                klass(item['name'], createstatement=item['sql'],
-                      oid=item['name']))
-        self.db.set_dirty(objects.Table, False)
-        self.db.set_dirty(objects.View, False)
+            token = (createstatement, tuple(sorted(indexes.get(name, ()))))
+            yield (klass, name, None, token,
+                   {'name': name, 'createstatement': createstatement})
+
+    def sync(self):
+        # The schema version is incremented on every schema change.
+        schema_version = list(self.iter_query('pragma schema_version'))[0][0]
+        if schema_version == self._schema_version:
+            return objects.SyncResult([], [], [])
+        self._schema_version = schema_version
+        rows = self._iter_relations(self.iter_query(SQL_RELATIONS))
+        return self._sync_nodes((objects.Table, objects.View), list(rows))
 
-    def refresh_types(self, type_clss):
+    def _get_refresh_loaders(self, type_clss):
+        loaders = []
         if objects.Column in type_clss:
-            self._refresh_columns()
+            loaders.extend(self._get_column_loaders())
         if objects.ForeignKey in type_clss:
-            self._refresh_foreign_keys()
-
-    def _refresh_columns(self):
-        for obj in chain(self.find(type_cls=objects.Table),
-                         self.find(type_cls=objects.View)):
-            # parameter substitution does not work for pragma statements.
-            for item in self.run_query('pragma table_info(%s)' % obj.name):
-                obj.add_child(objects.Column(
-                    item['name'], oid='%s.%s' % (obj.oid, item['cid'])))
-
-    def _refresh_foreign_keys(self):
-        for obj in self.find(type_cls=objects.Table):
-            for item in self.run_query(
-                    'pragma foreign_key_list(%s)' % obj.name):
-                ftable = self.db.find_by_oid(item['table'])
-                obj.add_child(objects.ForeignKey(
-                    name='%s.%s' % (obj.name, item['from']),
-                    oid='%s.%s' % (obj.name, item['from'] ),
-                    foreign_table=ftable))
+            loaders.extend(self._get_foreign_key_loaders())
+        index_types = [t for t in (objects.Index, objects.UniqueConstraint)
+                       if t in type_clss]
+        if index_types:
+            loaders.extend(self._get_index_loaders(index_types))
+        if objects.PrimaryKey in type_clss:
+            loaders.extend(self._get_primary_key_loaders())
+        return loaders
+
+    def _get_object_loaders(self, obj, type_cls):
+        if type_cls == objects.Column:
+            return self._get_column_loaders([obj])
+        elif type_cls == objects.ForeignKey:
+            return self._get_foreign_key_loaders([obj])
+        elif type_cls in (objects.Index, objects.UniqueConstraint):
+            return self._get_index_loaders([type_cls], [obj])
+        elif type_cls == objects.PrimaryKey:
+            return self._get_primary_key_loaders([obj])
+        return []
+
+    def _has_pragma_functions(self):
+        # Table-valued pragma functions are available since SQLite 3.16.0.
+        if self._pragma_functions is None:
+            self._pragma_functions = self.dbapi.sqlite_version_info >= (3, 16)
+        return self._pragma_functions
+
+    def _get_column_loaders(self, objs=None):
+        if objs is None and self._has_pragma_functions():
+            # Load the columns of all tables and views in one go.
+            return [Loader(SQL_BULK_COLUMNS, None, self._load_columns, True)]
+        if objs is None:
+            objs = chain(self.find(type_cls=objects.Table),
+                         self.find(type_cls=objects.View))
+        return [Loader('pragma table_info(%s)' % _quote(obj.name), None,
+                       partial(self._load_table_columns, obj), False)
+                for obj in objs]
+
+    def _load_columns(self, rows):
+        for row in rows:
+            obj = self.find_by_oid(row[0])
+            if obj is not None:
+                self._add_column(obj, *row[1:6])
+
+    def _load_table_columns(self, obj, rows):
+        for row in rows:
+            self._add_column(obj, *row[:5])
+
+    def _add_column(self, obj, cid, name, data_type, notnull, default):
+        obj.add_child(objects.Column(
+            name, oid='%s.%s' % (obj.oid, cid), data_type=data_type,
+            nullable=not notnull, default=default, position=cid + 1))
+
+    def _get_foreign_key_loaders(self, objs=None):
+        if objs is None and self._has_pragma_functions():
+            return [Loader(SQL_BULK_FOREIGN_KEYS, None,
+                           self._load_foreign_keys, True)]
+        if objs is None:
+            objs = self.find(type_cls=objects.Table)
+        return [Loader('pragma foreign_key_list(%s)' % _quote(obj.name),
+                       None, partial(self._load_table_foreign_keys, obj),
+                       False)
+                for obj in objs]
+
+    def _load_foreign_keys(self, rows):
+        for tbl, ftable, column in rows:
+            obj = self.find_by_oid(tbl)
+            if obj is not None:
+                self._add_foreign_key(obj, ftable, column)
+
+    def _load_table_foreign_keys(self, obj, rows):
+        for row in rows:
+            self._add_foreign_key(obj, row[2], row[3])
+
+    def _add_foreign_key(self, obj, ftable, column):
+        obj.add_child(objects.ForeignKey(
+            name='%s.%s' % (obj.name, column),
+            oid='%s.%s' % (obj.name, column),
+            foreign_table=self.find_by_oid(ftable)))
+
+    def _get_index_loaders(self, type_clss, objs=None):
+        # Unique constraints are indexes created by the constraint.
+        if objs is None and self._has_pragma_functions():
+            return [Loader(SQL_BULK_INDEXES, None,
+                           partial(self._load_indexes, type_clss), True)]
+        if objs is None:
+            objs = self.find(type_cls=objects.Table)
+        loaders = []
+        for obj in objs:
+            if self._has_pragma_functions():
+                loaders.append(Loader(
+                    SQL_TABLE_INDEXES, (obj.name,),
+                    partial(self._load_table_indexes, type_clss, obj),
+                    False))
+                continue
+            # Without pragma functions the columns of each index need
+            # another query. They are collected first and used when
+            # the index list is consumed.
+            columns = {}
+            for name in (self._index_names or {}).get(obj.name, ()):
+                loaders.append(Loader(
+                    'pragma index_info(%s)' % _quote(name), None,
+                    partial(self._load_index_info, columns, name), False))
+            loaders.append(Loader(
+                'pragma index_list(%s)' % _quote(obj.name), None,
+                partial(self._load_index_list, type_clss, obj, columns),
+                False))
+        return loaders
+
+    def _load_indexes(self, type_clss, rows):
+        # Rows are ordered by table and index, one row per column.
+        for (tbl, name, unique, origin), columns in _group_columns(rows):
+            self._add_index(type_clss, self.find_by_oid(tbl), name, unique,
+                            origin, columns)
+
+    def _load_table_indexes(self, type_clss, obj, rows):
+        for (name, unique, origin), columns in _group_columns(rows):
+            self._add_index(type_clss, obj, name, unique, origin, columns)
+
+    def _load_index_info(self, columns, name, rows):
+        columns[name] = [row[2] for row in rows if row[2] is not None]
+
+    def _load_index_list(self, type_clss, obj, columns, rows):
+        for row in rows:
+            name, unique, origin = row[1], row[2], row[3]
+            self._add_index(type_clss, obj, name, unique, origin,
+                            columns.get(name, ()))
+
+    def _add_index(self, type_clss, obj, name, unique, origin, columns):
+        if obj is None:
+            return
+        if objects.Index in type_clss:
+            obj.add_child(objects.Index(
+                name, oid=name, columns=tuple(columns), unique=bool(unique)))
+        if objects.UniqueConstraint in type_clss and origin == 'u':
+            obj.add_child(objects.UniqueConstraint(
+                name, oid='%s#unique' % name, columns=tuple(columns)))
+
+    def _get_primary_key_loaders(self, objs=None):
+        # The primary key of rowid tables has no index, table_info
+        # lists the key columns of all tables.
+        if objs is None and self._has_pragma_functions():
+            return [Loader(SQL_BULK_PRIMARY_KEYS, None,
+                           self._load_primary_keys, True)]
+        if objs is None:
+            objs = self.find(type_cls=objects.Table)
+        return [Loader('pragma table_info(%s)' % _quote(obj.name), None,
+                       partial(self._load_table_primary_key, obj), False)
+                for obj in objs]
+
+    def _load_primary_keys(self, rows):
+        columns = {}
+        for tbl, name in rows:
+            columns.setdefault(tbl, []).append(name)
+        for tbl in columns:
+            self._add_primary_key(self.find_by_oid(tbl), columns[tbl])
+
+    def _load_table_primary_key(self, obj, rows):
+        keys = sorted((row[5], row[1]) for row in rows if row[5])
+        if keys:
+            self._add_primary_key(obj, [name for _, name in keys])
+
+    def _add_primary_key(self, obj, columns):
+        if obj is not None:
+            obj.add_child(objects.PrimaryKey(
+                'pk_%s' % obj.name, oid='%s#pk' % obj.oid,
+                columns=tuple(columns)))
+
+
+def _group_columns(rows):
+    # Rows are ordered by key, the last value of a row is a column
+    # name. Yields (key, column names) tuples.
+    for key, group in groupby(rows, lambda row: tuple(row[:-1])):
+        yield key, [row[-1] for row in group if row[-1] is not None]
+
+
+def _quote(name):
+    # parameter substitution does not work for pragma statements.
+    return '"%s"' % name.replace('"', '""')
+
+
+SQL_RELATIONS = 'select type, name, sql, tbl_name from sqlite_master'
+
+SQL_BULK_COLUMNS = """
+select m.name as tbl, p.cid, p.name, p.type, p."notnull", p.dflt_value
+from sqlite_master m, pragma_table_info(m.name) p
+where m.type in ('table', 'view')
+"""
+
+SQL_BULK_FOREIGN_KEYS = """
+select m.name as tbl, p."table", p."from"
+from sqlite_master m, pragma_foreign_key_list(m.name) p
+where m.type = 'table'
+"""
+
+SQL_BULK_INDEXES = """
+select m.name as tbl, il.name, il."unique", il.origin, ii.name
+from sqlite_master m, pragma_index_list(m.name) il,
+     pragma_index_info(il.name) ii
+where m.type = 'table'
+order by m.name, il.name, ii.seqno
+"""
+
+SQL_TABLE_INDEXES = """
+select il.name, il."unique", il.origin, ii.name
+from pragma_index_list(?) il, pragma_index_info(il.name) ii
+order by il.name, ii.seqno
+"""
+
+SQL_BULK_PRIMARY_KEYS = """
+select m.name as tbl, p.name
+from sqlite_master m, pragma_table_info(m.name) p
+where m.type = 'table' and p.pk > 0
+order by m.name, p.pk
+"""
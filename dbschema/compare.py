@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Comparing database object trees."""
+
+from collections import namedtuple
+
+
+#: Result of :func:`diff`. added and removed are lists of nodes,
+#: changed is a list of (old, new) tuples.
+DiffResult = namedtuple('DiffResult', 'added removed changed')
+
+# Fields not compared, oids differ between databases.
+_IGNORED_FIELDS = frozenset(['name', 'oid'])
+
+
+def diff(db_a, db_b, types=None):
+    """Compares two databases.
+
+    Nodes are matched by type and qualified name, i.e. the names of
+    the node and its ancestors. Nodes only found in db_b are added,
+    nodes only found in db_a are removed. Matched nodes changed if
+    any of their attributes (except oid), backend-specific extras or
+    referenced nodes (e.g. the foreign table of a foreign key)
+    differ. Children of added or removed nodes are reported as well.
+
+    Both databases are fully loaded before comparing, snapshots can
+    be compared like live databases.
+
+    :param db_a: The old :class:`~dbschema.objects.Database`.
+    :param db_b: The new :class:`~dbschema.objects.Database`.
+    :param types: If given, only nodes of these types are reported.
+    :rtype: :class:`DiffResult`
+    """
+    db_a.refresh_all()
+    db_b.refresh_all()
+    keys_a, nodes_a = _index(db_a)
+    keys_b, nodes_b = _index(db_b)
+    if types is not None:
+        types = tuple(types)
+    result = DiffResult([], [], [])
+    for key, node in nodes_a.items():
+        if types is not None and not isinstance(node, types):
+            continue
+        if key not in nodes_b:
+            result.removed.append(node)
+    for key, node in nodes_b.items():
+        if types is not None and not isinstance(node, types):
+            continue
+        old = nodes_a.get(key)
+        if old is None:
+            result.added.append(node)
+        elif _changed(old, keys_a, node, keys_b):
+            result.changed.append((old, node))
+    return result
+
+
+def _index(db):
+    # Returns node keys by id and nodes by key in tree order.
+    keys = {id(db): ()}
+    nodes = {}
+    for node in db._walk():
+        path = keys[id(node.parent)] + (node.name,)
+        keys[id(node)] = path
+        nodes[(node.__class__.__name__, path)] = node
+    return keys, nodes
+
+
+def _changed(old, keys_old, new, keys_new):
+    for field in old._fields:
+        if field in _IGNORED_FIELDS:
+            continue
+        if getattr(old, field) != getattr(new, field):
+            return True
+    for field in old._ref_fields:
+        ref_old = getattr(old, field)
+        ref_new = getattr(new, field)
+        if (ref_old is None) != (ref_new is None):
+            return True
+        if ref_old is not None and (keys_old.get(id(ref_old))
+                                    != keys_new.get(id(ref_new))):
+            return True
+    return (old._extras or {}) != (new._extras or {})
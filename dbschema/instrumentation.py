@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Hooks to measure catalog queries and refreshes.
+
+A hook is passed to :func:`dbschema.open` and called after each
+catalog query and after each phase of loading the object tree. Phases
+are ``'initialize'`` (:func:`dbschema.open`), ``'refresh_types'``
+(loading a type for the whole database) and ``'refresh_object'``
+(loading children of a single object, see
+:meth:`dbschema.objects.Database.refresh`).
+"""
+
+import threading
+
+
+class Hook(object):
+    """Base class for instrumentation hooks, all methods are no-ops."""
+
+    def on_query(self, db, sql, params, seconds, rows):
+        """Called when a query is done.
+
+        :param seconds: Wall time from executing the query until the
+          last row was fetched.
+        :param rows: Number of rows fetched.
+        """
+
+    def on_phase(self, db, phase, seconds, queries, rows, nodes):
+        """Called when a phase is done.
+
+        :param phase: Name of the phase.
+        :param seconds: Wall time of the phase.
+        :param queries: Number of queries run in the phase.
+        :param rows: Number of rows fetched in the phase.
+        :param nodes: Number of nodes added to the tree in the phase.
+        """
+
+
+class CallbackHook(Hook):
+    """Passes measurements as dicts to a callback.
+
+    Query events have the keys ``event`` (``'query'``), ``backend``,
+    ``sql``, ``params``, ``seconds`` and ``rows``. Phase events have
+    the keys ``event`` (``'phase'``), ``backend``, ``phase``,
+    ``seconds``, ``queries``, ``rows`` and ``nodes``.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def on_query(self, db, sql, params, seconds, rows):
+        self.callback({'event': 'query', 'backend': db.name, 'sql': sql,
+                       'params': params, 'seconds': seconds, 'rows': rows})
+
+    def on_phase(self, db, phase, seconds, queries, rows, nodes):
+        self.callback({'event': 'phase', 'backend': db.name,
+                       'phase': phase, 'seconds': seconds,
+                       'queries': queries, 'rows': rows, 'nodes': nodes})
+
+
+class Counters(Hook):
+    """Accumulates measurements in Prometheus-style counters.
+
+    Counters are labeled by backend and, for phases, by phase. Use
+    :meth:`get` to read a single counter or :meth:`render` for the
+    Prometheus text format.
+    """
+
+    def __init__(self, prefix='dbschema'):
+        self.prefix = prefix
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _inc(self, name, labels, value):
+        key = ('%s_%s' % (self.prefix, name), tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def on_query(self, db, sql, params, seconds, rows):
+        labels = {'backend': db.name}
+        self._inc('queries_total', labels, 1)
+        self._inc('query_seconds_total', labels, seconds)
+        self._inc('query_rows_total', labels, rows)
+
+    def on_phase(self, db, phase, seconds, queries, rows, nodes):
+        labels = {'backend': db.name, 'phase': phase}
+        self._inc('phases_total', labels, 1)
+        self._inc('phase_seconds_total', labels, seconds)
+        self._inc('nodes_created_total', labels, nodes)
+
+    def get(self, name, **labels):
+        """Returns the value of a counter, name is without prefix."""
+        key = ('%s_%s' % (self.prefix, name), tuple(sorted(labels.items())))
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        """Returns all counters in the Prometheus text format."""
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = []
+        last_name = None
+        for (name, labels), value in items:
+            if name != last_name:
+                lines.append('# TYPE %s counter' % name)
+                last_name = name
+            label_str = ','.join('%s="%s"' % (k, _escape(v))
+                                 for k, v in labels)
+            lines.append('%s{%s} %s' % (name, label_str, value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
@@ -1,39 +1,111 @@
 # -*- coding: utf-8 -*-
 
 import importlib
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import chain, islice
+from timeit import default_timer as timer
 
 from ..exceptions import DBSchemaError
 
 
 DOESNOTEXIST = object()
 
+#: Result of :meth:`Database.sync`, lists of added, removed and
+#: changed objects.
+SyncResult = namedtuple('SyncResult', 'added removed changed')
+
+_NO_CHILDREN = frozenset()
+
 
 class Node(object):
-    """Base class for database objects."""
+    """Base class for database objects.
+
+    Nodes use ``__slots__`` to keep large catalogs small in memory.
+    Keyword arguments that don't match a slot are stored in
+    :attr:`extras`, a side table that is only allocated when needed.
+    """
+
+    __slots__ = ('_children', 'parent', 'name', 'description', 'oid',
+                 '_extras', '_identity', '_hash')
+
+    # Attributes holding plain values and references to other nodes,
+    # used for serialization.
+    _fields = ('name', 'description', 'oid')
+    _ref_fields = ()
+    # If False, nodes are left out of the database wide type and name
+    # indexes, used for numerous leaves like columns.
+    _indexed = True
 
     def __init__(self, name, **kwargs):
         """Constructor."""
-        # TODO(andi) maybe it's more efficient to store children in a
-        # dict (oid -> object)? It would improve oid lookups and it
-        # would be much easier to replace a child object.
-        self.children = set([])
+        # Children are stored in buckets by type, each bucket maps
+        # the oid of a child to the child object. Allocated by
+        # add_child().
+        self._children = None
         self.parent = None
         self.name = name  #: The name of the object.
         self.description = None  #: The description of the object.
         self.oid = None  #: A unique identifier provided by the underlying backend.
+        self._extras = None
+        self._identity = None
+        self._hash = None
         for key in kwargs:
-            setattr(self, key, kwargs[key])
+            try:
+                setattr(self, key, kwargs[key])
+            except AttributeError:
+                self.extras[key] = kwargs[key]
+
+    def __getattr__(self, key):
+        # Only called when there's no slot with that name.
+        if key != '_extras':
+            extras = self._extras
+            if extras is not None and key in extras:
+                return extras[key]
+        raise AttributeError('%r object has no attribute %r'
+                             % (self.__class__.__name__, key))
 
     def __repr__(self):
+        parent_name = self.parent is not None and self.parent.name
         return '<%s:%s.%s at 0x%0x>' % (self.__class__.__name__,
-                                        self.parent.name or '??',
+                                        parent_name or '??',
                                         self.name or '??', id(self))
 
+    def _get_identity(self):
+        """Returns a key identifying this node.
+
+        The key is the type and the backend oid. Nodes without an oid
+        are identified by their type, their parent and their name. The
+        key is computed once and cached.
+        """
+        if self._identity is None:
+            if self.oid is not None:
+                self._identity = (self.__class__, self.oid)
+            elif self.parent is not None:
+                self._identity = (self.__class__, self.parent._get_identity(),
+                                  self.name)
+            else:
+                self._identity = (self.__class__, None, self.name)
+        return self._identity
+
     def __hash__(self):
-        return hash((self.__class__, self.parent, self.name))
+        if self._hash is None:
+            self._hash = hash(self._get_identity())
+        return self._hash
 
     def __eq__(self, other):
-        return hash(self) == hash(other)
+        if self is other:
+            return True
+        if not isinstance(other, Node):
+            return NotImplemented
+        return (hash(self) == hash(other)
+                and self._get_identity() == other._get_identity())
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
 
     def __lt__(self, other):
         return self.name < other.name
@@ -44,6 +116,39 @@ class Node(object):
         for child in self.children:
             child._print_tree(level + 1)
 
+    @property
+    def children(self):
+        """List of child objects in insertion order."""
+        return list(self._iter_children())
+
+    def _iter_children(self):
+        if self._children is None:
+            return iter(_NO_CHILDREN)
+        return chain.from_iterable(
+            bucket.values() for bucket in self._children.values())
+
+    def _get_child_key(self):
+        # Key of this node in the bucket of its parent.
+        if self.oid is not None:
+            return self.oid
+        return self.name
+
+    def get_child(self, oid, type_cls):
+        """Returns the child of type type_cls with the given oid or None."""
+        if self._children is None:
+            return None
+        bucket = self._children.get(type_cls)
+        if bucket is None:
+            return None
+        return bucket.get(oid)
+
+    @property
+    def extras(self):
+        """Dictionary of backend-specific attributes."""
+        if self._extras is None:
+            self._extras = {}
+        return self._extras
+
     @property
     def db(self):
         if isinstance(self, Database):
@@ -51,10 +156,15 @@ class Node(object):
         return self.parent.db
 
     def add_child(self, obj):
-        """Adds a child objects."""
+        """Adds a child objects.
+
+        An existing child of the same type and with the same oid is
+        replaced by obj. If obj has no children yet, it takes over the
+        children of the replaced object.
+        """
         obj.parent = self
-        if obj not in self.children:
-            self.children.add(obj)
+        # The identity of nodes without an oid depends on the parent.
+        obj._identity = obj._hash = None
         # TODO(andi): This assumes that the node is already child of a root
         # Database node which makes it impossible to create a sub-tree that
         # should be added to the real root later. For example:
@@ -64,9 +174,119 @@ class Node(object):
         # sub = Node()
         # sub.add_child(Node())  # <-- fails
         # node.add_child(db)
-        self.db._oid_idx[obj.oid] = obj
+        db = self.db
+        if self._children is None:
+            self._children = {}
+        bucket = self._children.get(obj.__class__)
+        if bucket is None:
+            bucket = self._children[obj.__class__] = {}
+        key = obj._get_child_key()
+        old = bucket.get(key)
+        if old is obj:
+            return obj
+        if old is not None:
+            db._remove_from_indexes(old)
+            if obj._children is None and old._children is not None:
+                obj._children, old._children = old._children, None
+                for child in obj._iter_children():
+                    child.parent = obj
+        bucket[key] = obj
+        db._add_to_indexes(obj)
         return obj
 
+    def remove_child(self, obj):
+        """Removes a child object and its subtree.
+
+        :raises: :exc:`dbschema.exceptions.DBSchemaError` if obj isn't
+          a child of this node.
+        """
+        key = obj._get_child_key()
+        bucket = self._children and self._children.get(obj.__class__)
+        if not bucket or bucket.get(key) is not obj:
+            raise DBSchemaError('%r is not a child of %r' % (obj, self))
+        del bucket[key]
+        if not bucket:
+            del self._children[obj.__class__]
+        db = self.db
+        db._remove_from_indexes(obj)
+        for child in obj._walk():
+            db._remove_from_indexes(child)
+        obj.parent = None
+
+    def _get_root(self):
+        # Like db, but returns None for nodes not attached to a database.
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        if isinstance(node, Database):
+            return node
+        return None
+
+    def _is_ancestor_of(self, obj):
+        while obj is not None:
+            if obj is self:
+                return True
+            obj = obj.parent
+        return False
+
+    def _walk(self, recurse=True):
+        """Yields all children, depth-first if recurse is ``True``."""
+        if not recurse:
+            for child in self._iter_children():
+                yield child
+            return
+        stack = [self._iter_children()]
+        while stack:
+            for child in stack[-1]:
+                yield child
+                if child._children:
+                    stack.append(child._iter_children())
+                break
+            else:
+                stack.pop()
+
+    def _find_indexed(self, type_cls, name, parent, recurse):
+        """Returns candidates for find() from the database indexes.
+
+        Returns ``None`` if the indexes can't narrow down the search
+        and the subtree needs to be walked instead.
+        """
+        db = self._get_root()
+        if db is None:
+            return None
+        if not recurse:
+            if parent is not None and parent != self:
+                return ()
+            parent = self
+        elif self is not db and parent is not None:
+            if not self._is_ancestor_of(parent):
+                return ()
+        if parent is not None:
+            # The children buckets of the parent serve as index.
+            if not parent._children:
+                return ()
+            return chain.from_iterable(
+                bucket.values() for t, bucket in parent._children.items()
+                if type_cls is None or issubclass(t, type_cls))
+        if name is None and (type_cls is None or self is not db):
+            # Walking the subtree is cheaper than filtering the
+            # database wide type index by ancestry.
+            return None
+        if db._has_unindexed_types(type_cls):
+            # Leaf nodes are only kept in the buckets of their parents.
+            return None
+        types = db._get_indexed_types(type_cls)
+        if name is not None:
+            buckets = [db._name_idx.get((t, name)) for t in types]
+        else:
+            buckets = [db._type_idx.get(t) for t in types]
+        candidates = chain.from_iterable(b.values() for b in buckets if b)
+        if self is not db:
+            # Few nodes share a name, filter them by ancestry.
+            return (node for node in candidates
+                    if node is not self and self._is_ancestor_of(node))
+        return candidates
+
     def find(self, type_cls=None, name=None, parent=None,
              recurse=True, **kwargs):
         """Yields database objects matching search parameters.
@@ -74,6 +294,9 @@ class Node(object):
         All search parameters are optional. If not parameters are
         given all database objects are returned.
 
+        Lookups by type, name or parent are answered from the indexes
+        maintained by :class:`Database` whenever possible.
+
         :param type_cls: Find specific types.
         :type type_cls: Subclass of :class:`Node`
         :param name: The name to match.
@@ -86,45 +309,46 @@ class Node(object):
 
         :returns: Iterator of :class:`Node` instances.
         """
-        for child in self.children:
-            yield_child = True
+        candidates = self._find_indexed(type_cls, name, parent, recurse)
+        if candidates is None:
+            candidates = self._walk(recurse)
+        for child in candidates:
             if type_cls is not None and not isinstance(child, type_cls):
-                yield_child = False
+                continue
             if name is not None and child.name != name:
-                yield_child = False
+                continue
             if parent is not None and child.parent != parent:
-                yield_child = False
+                continue
             for key in kwargs:
                 child_value = getattr(child, key, DOESNOTEXIST)
                 if child_value == DOESNOTEXIST or child_value != kwargs[key]:
-                    yield_child = False
                     break
-            if yield_child:
+            else:
                 yield child
-            if recurse:
-                # yield from FTW! But we want to support older Python
-                # versions too...
-                for cchild in child.find(type_cls=type_cls, name=name,
-                                         parent=parent, recurse=recurse,
-                                         **kwargs):
-                    yield cchild
 
     def find_exact(self, **kwargs):
         """Returns exact one match or None.
 
         For parameter reference see :func:`find`.
         """
-        results = list(self.find(**kwargs))
+        results = list(islice(self.find(**kwargs), 2))
         if len(results) == 1:
             return results[0]
         return None
 
     def get_child_types(self):
         """Returns a set of child types for this node."""
-        types = set()
-        for child in self.children:
-            types.add(child.__class__)
-        return types
+        if self._children is None:
+            return set()
+        return set(self._children)
+
+
+def _discard(index, key, obj):
+    nodes = index.get(key)
+    if nodes is not None and nodes.get(obj) is obj:
+        del nodes[obj]
+        if not nodes:
+            del index[key]
 
 
 class Database(Node):
@@ -132,27 +356,59 @@ class Database(Node):
 
     dbapi_module = None
     structure = []
+    #: Types the backend can refresh for single objects, see
+    #: :meth:`refresh`.
+    scoped_types = ()
 
-    def __init__(self, name):
+    def __init__(self, name, scoped_refresh=False):
         super(Database, self).__init__(name)
+        #: If ``True`` children of dirty types are loaded per object
+        #: when they are first requested instead of for the whole
+        #: database.
+        self.scoped_refresh = scoped_refresh
         self._conn = None
         self._conn_kwargs = None
+        self._pool = None
+        #: A :class:`dbschema.instrumentation.Hook` or ``None``.
+        self.hook = None
+        # Totals reported to the hook.
+        self._stats_queries = 0
+        self._stats_rows = 0
+        self._stats_nodes = 0
         self._oid_idx = {}
+        # Secondary indexes, each maps a key to a dict of nodes. The
+        # children buckets of each node act as (parent, type) index.
+        self._type_idx = {}  # type -> nodes
+        self._name_idx = {}  # (type, name) -> nodes
+        self._unindexed_types = set()  # types left out of both
+        self._fk_idx = {}  # foreign table -> foreign keys
         self._dirty = set()
+        # Per object state, both map a type to a set of objects.
+        self._clean_objs = {}  # refreshed although the type is dirty
+        self._dirty_objs = {}  # to be refreshed, the type isn't dirty
+        # Change tokens of loaded objects by oid, used by sync().
+        self._sync_tokens = {}
+        # Resolved default namespace, see get_default_namespace().
+        self._default_ns_cache = DOESNOTEXIST
+        self._child_types = {}  # type -> child types from structure
         for type_cls, children in self.structure:
             self._populate_dirty(type_cls, children)
 
     def _populate_dirty(self, type_cls, children):
         self._dirty.add(type_cls)
         children = children or []
-        for type_cls, cchildren in children:
-            self._populate_dirty(type_cls, cchildren)
+        child_types = self._child_types.setdefault(type_cls, set())
+        for ctype_cls, cchildren in children:
+            child_types.add(ctype_cls)
+            self._populate_dirty(ctype_cls, cchildren)
 
-    def set_connection(self, connection, **connect_kwargs):
+    def set_connection(self, connection, pool=None, **connect_kwargs):
         """Sets the connection to interact with the database.
 
         :param connection: If not ``None``, a already opened database
           connection.  :type connection: DB-API2 connection or None
+        :param pool: A :class:`dbschema.pool.ConnectionPool` to draw
+          connections from if connect_kwargs are given.
         :param connect_kwargs: Connection kwargs if not connection
           is given.
 
@@ -165,9 +421,11 @@ class Database(Node):
         elif connection:
             self._conn = connection
             self._conn_kwargs = None
+            self._pool = None
         else:
             self._conn = None
             self._conn_kwargs = connect_kwargs
+            self._pool = pool
 
     @property
     def dbapi(self):
@@ -182,12 +440,50 @@ class Database(Node):
     def connection(self):
         if self._conn is None:
             try:
-                self._conn = self.dbapi.connect(**self._conn_kwargs)
+                if self._pool is not None:
+                    self._conn = self._pool.acquire(self, self._conn_kwargs)
+                else:
+                    self._conn = self.dbapi.connect(**self._conn_kwargs)
             except Exception as err:
                 raise DBSchemaError(
                     'Could not connect to database: %s' % err)
         return self._conn
 
+    def _check_connection(self, conn):
+        """Returns ``True`` if conn is still usable."""
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute('select 1')
+                cur.fetchall()
+            finally:
+                cur.close()
+        except Exception:
+            return False
+        return True
+
+    def close(self):
+        """Closes the connection or returns it to the pool.
+
+        Connections given to :func:`dbschema.open` are left open. The
+        object tree stays usable, a new connection is opened when the
+        next query runs.
+        """
+        conn = self._conn
+        if conn is None or self._conn_kwargs is None:
+            return
+        self._conn = None
+        if self._pool is not None:
+            self._pool.release(self, self._conn_kwargs, conn)
+        else:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def _initialize(self):
         """Initializes database objects.
 
@@ -199,6 +495,68 @@ class Database(Node):
         """
         pass
 
+    def _add_to_indexes(self, obj):
+        self._stats_nodes += 1
+        type_cls = obj.__class__
+        if type_cls is Namespace:
+            self._default_ns_cache = DOESNOTEXIST
+        if type_cls._indexed:
+            self._type_idx.setdefault(type_cls, {})[obj] = obj
+            self._name_idx.setdefault((type_cls, obj.name), {})[obj] = obj
+        else:
+            self._unindexed_types.add(type_cls)
+        if isinstance(obj, ForeignKey) and obj.foreign_table is not None:
+            self._fk_idx.setdefault(obj.foreign_table, {})[obj] = obj
+        self._oid_idx[obj.oid] = obj
+
+    def _record_query(self, sql, params, seconds, rows):
+        """Reports a finished query to the hook."""
+        self._stats_queries += 1
+        self._stats_rows += rows
+        self.hook.on_query(self, sql, params, seconds, rows)
+
+    @contextmanager
+    def _phase(self, name):
+        """Reports the wrapped block as a phase to the hook."""
+        hook = self.hook
+        if hook is None:
+            yield
+            return
+        queries = self._stats_queries
+        rows = self._stats_rows
+        nodes = self._stats_nodes
+        start = timer()
+        try:
+            yield
+        finally:
+            hook.on_phase(self, name, timer() - start,
+                          self._stats_queries - queries,
+                          self._stats_rows - rows,
+                          self._stats_nodes - nodes)
+
+    def _remove_from_indexes(self, obj):
+        type_cls = obj.__class__
+        if type_cls is Namespace:
+            self._default_ns_cache = DOESNOTEXIST
+        _discard(self._type_idx, type_cls, obj)
+        _discard(self._name_idx, (type_cls, obj.name), obj)
+        if isinstance(obj, ForeignKey) and obj.foreign_table is not None:
+            _discard(self._fk_idx, obj.foreign_table, obj)
+        if self._oid_idx.get(obj.oid) is obj:
+            del self._oid_idx[obj.oid]
+
+    def _has_unindexed_types(self, type_cls):
+        """Returns ``True`` if nodes of type_cls may be missing from
+        the type and name indexes."""
+        if type_cls is None:
+            return bool(self._unindexed_types)
+        return any(issubclass(t, type_cls) for t in self._unindexed_types)
+
+    def _get_indexed_types(self, type_cls):
+        if type_cls is None:
+            return list(self._type_idx)
+        return [t for t in self._type_idx if issubclass(t, type_cls)]
+
     def find_by_oid(self, oid):
         return self._oid_idx.get(oid, None)
 
@@ -212,15 +570,26 @@ class Database(Node):
     def get_default_namespace(self):
         """Returns the default namespace or None.
 
+        The result is cached until namespaces are added or removed or
+        :meth:`invalidate_default_namespace` is called.
+
         :rtype: :class:`Namespace` or ``None``
         """
         return None
 
+    def invalidate_default_namespace(self):
+        """Forgets the cached default namespace.
+
+        Call this after changing the default namespace on the
+        connection, e.g. with ``SET search_path`` or ``USE``.
+        """
+        self._default_ns_cache = DOESNOTEXIST
+
     def _get_types_from_default_ns(self, type_cls):
         """Helper to yield objects from default namespace."""
         self._refresh_types_internal([type_cls])
         nsp = self.get_default_namespace() or self
-        return nsp.find(type_cls=type_cls)
+        return nsp.find(type_cls=type_cls, recurse=False)
 
     def get_tables(self):
         """Yields all tables from default namespace.
@@ -236,25 +605,68 @@ class Database(Node):
         """
         return self._get_types_from_default_ns(View)
 
-    # def refresh(self, obj, type_cls=None):
-    #     """Updates obj.
+    def refresh_all(self):
+        """Loads all types and objects that are not loaded yet."""
+        self._refresh_types_internal(
+            self._dirty.union(t for t in self._dirty_objs
+                              if self._dirty_objs[t]))
 
-    #     If type_cls is given, the given object is requested to be
-    #     updated in regard to the given type_cls. For example, if obj
-    #     is a table and type_cls :class:`Column` then this function
-    #     should populate the columns for obj.
+    def refresh(self, obj, type_cls):
+        """Refreshes the children of obj of a certain type.
 
-    #     :param type_cls: A :class:`Node` subclass.
-    #     """
-    #     pass
+        For example, if obj is a table and type_cls :class:`Column`
+        the columns of that table are loaded. If obj is a namespace
+        the columns of all tables and views in that namespace are
+        loaded. If the backend can't scope refreshes of type_cls, the
+        type is refreshed for the whole database.
 
-    def set_dirty(self, type_cls, dirty):
+        :param obj: A :class:`Node` instance.
+        :param type_cls: A :class:`Node` subclass.
+        """
+        if obj is self or type_cls not in self.scoped_types:
+            self.set_dirty(type_cls, True)
+            self._refresh_types_internal([type_cls])
+            return
+        self._remove_descendants(obj, type_cls)
+        with self._phase('refresh_object'):
+            self._refresh_object(obj, type_cls)
+        self.set_dirty(type_cls, False, obj=obj)
+
+    def _remove_descendants(self, obj, type_cls):
+        for child in list(obj.find(type_cls=type_cls)):
+            child.parent.remove_child(child)
+
+    def _refresh_object(self, obj, type_cls):
+        """Loads children of type type_cls for obj.
+
+        Backends implement this for all types listed in
+        :attr:`scoped_types`.
+        """
+        raise NotImplementedError('Database._refresh_object()')
+
+    def set_dirty(self, type_cls, dirty, obj=None):
         """Marks/unmarks a certain type as dirty.
 
         :param type_cls: A :class:`Node` subclass.
         :param dirty: Wether the type is dirty.
         :type dirty: bool
+        :param obj: If given, only the children of type type_cls of
+          this object are marked/unmarked.
+        :type obj: :class:`Node` or ``None``
         """
+        if obj is not None:
+            dirty_objs = self._dirty_objs.setdefault(type_cls, set())
+            clean_objs = self._clean_objs.setdefault(type_cls, set())
+            if dirty:
+                dirty_objs.add(obj)
+                clean_objs.discard(obj)
+            else:
+                dirty_objs.discard(obj)
+                if type_cls in self._dirty:
+                    clean_objs.add(obj)
+            return
+        self._clean_objs.pop(type_cls, None)
+        self._dirty_objs.pop(type_cls, None)
         if dirty and type_cls not in self._dirty:
             self._dirty.add(type_cls)
         elif not dirty and type_cls in self._dirty:
@@ -269,16 +681,142 @@ class Database(Node):
         pass
 
     def _refresh_types_internal(self, type_clss):
+        tbd = self._take_dirty_types(type_clss)
+        if tbd:
+            with self._phase('refresh_types'):
+                self.refresh_types(tbd)
+        for type_cls in type_clss:
+            for obj in list(self._dirty_objs.get(type_cls, ())):
+                if obj in self._dirty_objs.get(type_cls, ()):
+                    self.refresh(obj, type_cls)
+
+    def _take_dirty_types(self, type_clss):
+        """Returns the dirty types in type_clss and marks them clean."""
         tbd = set(type_clss).intersection(self._dirty)
-        if not tbd:
-            return
-        self._dirty = self._dirty.difference(tbd)
-        self.refresh_types(tbd)
+        if tbd:
+            self._dirty = self._dirty.difference(tbd)
+            for type_cls in tbd:
+                self._clean_objs.pop(type_cls, None)
+                self._dirty_objs.pop(type_cls, None)
+        return tbd
+
+    def sync(self):
+        """Updates the tree with changes made in the database.
+
+        Only objects that changed since they were loaded are updated,
+        in place. Children of changed objects, like columns, are
+        loaded again when they are requested.
+
+        :rtype: :class:`SyncResult`
+        """
+        raise NotImplementedError('Database.sync()')
+
+    def _sync_nodes(self, type_clss, rows):
+        """Patches nodes of the given types to match rows.
+
+        Helper for backend implementations of :meth:`sync`. rows
+        yields (type_cls, oid, parent_oid, token, attrs) tuples for
+        all objects of type_clss in the database, parents before
+        their children. attrs is a dict of attributes including the
+        name. An object changed if its token differs from the token
+        recorded in :attr:`_sync_tokens` when it was loaded.
+        """
+        # The search path may have changed too.
+        self.invalidate_default_namespace()
+        result = SyncResult([], [], [])
+        seen = set()
+        for type_cls, oid, parent_oid, token, attrs in rows:
+            seen.add(oid)
+            if parent_oid is None:
+                parent = self
+            else:
+                parent = self.find_by_oid(parent_oid)
+                if parent is None:
+                    continue
+            obj = self.find_by_oid(oid)
+            if obj is not None and (obj.__class__ is not type_cls
+                                    or obj.parent is not parent):
+                self._sync_remove(obj)
+                obj = parent.add_child(type_cls(oid=oid, **attrs))
+                self._sync_invalidate(obj)
+                result.changed.append(obj)
+            elif obj is None:
+                obj = parent.add_child(type_cls(oid=oid, **attrs))
+                self._sync_invalidate(obj)
+                result.added.append(obj)
+            elif self._sync_tokens.get(oid) != token:
+                self._remove_from_indexes(obj)
+                for key in attrs:
+                    try:
+                        setattr(obj, key, attrs[key])
+                    except AttributeError:
+                        obj.extras[key] = attrs[key]
+                self._add_to_indexes(obj)
+                self._sync_invalidate(obj)
+                result.changed.append(obj)
+            self._sync_tokens[oid] = token
+        # Remove children before their parents.
+        for type_cls in reversed(type_clss):
+            for obj in list(self._type_idx.get(type_cls, {}).values()):
+                if obj.oid not in seen and obj._get_root() is self:
+                    self._sync_remove(obj)
+                    result.removed.append(obj)
+        return result
+
+    def _sync_invalidate(self, obj):
+        # Drop children of obj and reload them when requested. Only
+        # types that can be refreshed per object are dropped, others,
+        # like the tables of a namespace, are patched by the same
+        # sync.
+        for child_type in self._child_types.get(obj.__class__, ()):
+            if child_type not in self.scoped_types:
+                continue
+            self._remove_descendants(obj, child_type)
+            self.set_dirty(child_type, True, obj=obj)
+
+    def _sync_remove(self, obj):
+        # Foreign keys pointing to obj are outdated now.
+        for fk in list(self._fk_idx.get(obj, {}).values()):
+            if fk.parent is not None and fk.parent is not obj:
+                self.set_dirty(ForeignKey, True, obj=fk.parent)
+        self._sync_tokens.pop(obj.oid, None)
+        obj.parent.remove_child(obj)
+
+    def _refresh_object_internal(self, obj, type_cls):
+        """Makes sure that children of type type_cls are loaded for obj."""
+        scope = self._get_refresh_scope(obj, type_cls)
+        if scope == 'type':
+            self._refresh_types_internal([type_cls])
+        elif scope == 'object':
+            self.refresh(obj, type_cls)
+
+    def _get_refresh_scope(self, obj, type_cls):
+        """Returns what needs to be refreshed to load children of obj.
+
+        Either ``None`` if the children are loaded, ``'type'`` if the
+        type needs to be refreshed or ``'object'`` if obj needs to be
+        refreshed.
+        """
+        if obj in self._dirty_objs.get(type_cls, ()):
+            return 'object'
+        if type_cls not in self._dirty:
+            return None
+        if not self.scoped_refresh or type_cls not in self.scoped_types:
+            return 'type'
+        clean_objs = self._clean_objs.get(type_cls, ())
+        node = obj
+        while node is not None:
+            if node in clean_objs:
+                return None
+            node = node.parent
+        return 'object'
 
 
 class Namespace(Node):
     """A namespace/schema in the database."""
 
+    __slots__ = ()
+
     def is_default_namespace(self):
         """Returns True if this namespace is a default namespace."""
         return self.db.get_default_namespace() == self
@@ -287,50 +825,145 @@ class Namespace(Node):
 class Table(Node):
     """A table in the database."""
 
+    __slots__ = ()
+
     def get_columns(self):
-        """Yields columns of this table.
+        """Yields columns of this table in ordinal order.
 
         :rtype: Generator of :class:`Column` instances.
         """
-        self.db._refresh_types_internal([Column])
-        return self.find(type_cls=Column)
+        self.db._refresh_object_internal(self, Column)
+        return self.find(type_cls=Column, recurse=False)
 
     def get_foreign_keys(self):
         """Yields foreign key definitions.
 
         :rtype: Generator of :class:`ForeignKey` instances.
         """
-        self.db._refresh_types_internal([ForeignKey])
-        return self.find(type_cls=ForeignKey)
+        self.db._refresh_object_internal(self, ForeignKey)
+        return self.find(type_cls=ForeignKey, recurse=False)
+
+    def get_indexes(self):
+        """Yields indexes of this table.
+
+        :rtype: Generator of :class:`Index` instances.
+        """
+        self.db._refresh_object_internal(self, Index)
+        return self.find(type_cls=Index, recurse=False)
+
+    def get_primary_key(self):
+        """Returns the primary key or ``None``.
+
+        :rtype: :class:`PrimaryKey` or ``None``
+        """
+        self.db._refresh_object_internal(self, PrimaryKey)
+        return self.find_exact(type_cls=PrimaryKey, recurse=False)
+
+    def get_unique_constraints(self):
+        """Yields unique constraints of this table.
+
+        :rtype: Generator of :class:`UniqueConstraint` instances.
+        """
+        self.db._refresh_object_internal(self, UniqueConstraint)
+        return self.find(type_cls=UniqueConstraint, recurse=False)
 
     def get_reverse_foreign_keys(self):
         """Yields foreign keys pointing to this table.
 
         :rtype: Generaotr of :class:`ForeignKey` instances.
         """
-        self.db._refresh_types_internal([ForeignKey])
-        return self.db.find(type_cls=ForeignKey, foreign_table=self)
+        db = self.db
+        db._refresh_types_internal([ForeignKey])
+        return iter(list(db._fk_idx.get(self, {}).values()))
 
 
 class View(Node):
     """A view in the database."""
 
+    __slots__ = ()
+
     def get_columns(self):
         """Yields columns of this view."""
-        self.db._refresh_types_internal([Column])
-        return self.find(type_cls=Column)
+        self.db._refresh_object_internal(self, Column)
+        return self.find(type_cls=Column, recurse=False)
 
 
 class Column(Node):
-    """A column of a view or table."""
+    """A column of a view or table.
+
+    Columns are leaves, they never allocate a children container.
+    They are only indexed by their parent and oid, lookups by type or
+    name across tables walk the tree.
+    """
+
+    __slots__ = ('data_type', 'nullable', 'default', 'position')
+    _fields = Node._fields + __slots__
+    _indexed = False
+
+    def __init__(self, *args, **kwargs):
+        #: The data type as shown by the backend, e.g. ``varchar(20)``.
+        self.data_type = None
+        #: ``True`` if the column accepts NULL values.
+        self.nullable = None
+        #: The default expression as string or ``None``.
+        self.default = None
+        #: The ordinal position, starting with 1.
+        self.position = None
+        super(Column, self).__init__(*args, **kwargs)
 
 
 class ForeignKey(Node):
     """A foreign key definition of a table."""
 
+    __slots__ = ('foreign_table', 'columns', 'foreign_columns')
+    _fields = Node._fields + ('columns', 'foreign_columns')
+    _ref_fields = ('foreign_table',)
+
     def __init__(self, *args, **kwargs):
         self.foreign_table = None
+        #: Tuple of column names in key order or ``None`` if unknown.
+        self.columns = None
+        #: Tuple of referenced column names or ``None`` if unknown.
+        self.foreign_columns = None
         super(ForeignKey, self).__init__(*args, **kwargs)
 
     def get_foreign_table(self):
         return self.foreign_table
+
+
+class Index(Node):
+    """An index of a table."""
+
+    __slots__ = ('columns', 'unique')
+    _fields = Node._fields + __slots__
+
+    def __init__(self, *args, **kwargs):
+        #: Tuple of indexed column names, expressions are left out.
+        self.columns = ()
+        #: ``True`` if this is a unique index.
+        self.unique = False
+        super(Index, self).__init__(*args, **kwargs)
+
+
+class PrimaryKey(Node):
+    """The primary key of a table."""
+
+    __slots__ = ('columns',)
+    _fields = Node._fields + __slots__
+
+    def __init__(self, *args, **kwargs):
+        #: Tuple of column names in key order.
+        self.columns = ()
+        super(PrimaryKey, self).__init__(*args, **kwargs)
+
+
+class UniqueConstraint(Node):
+    """A unique constraint of a table."""
+
+    __slots__ = ('columns',)
+    _fields = Node._fields + __slots__
+
+    def __init__(self, *args, **kwargs):
+        #: Tuple of column names in key order.
+        self.columns = ()
+        super(UniqueConstraint, self).__init__(*args, **kwargs)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Inspecting many databases in parallel."""
+
+import threading
+from collections import namedtuple
+
+try:
+    import queue
+except ImportError:  # py2
+    import Queue as queue
+
+from . import snapshot
+
+
+#: Result of opening a target with :func:`open_many`. Either db or
+#: error is ``None``. db is a :class:`~dbschema.objects.Database` or
+#: snapshot data if snapshots were requested.
+OpenResult = namedtuple('OpenResult', 'target db error')
+
+
+def open_many(targets, workers=4, snapshots=False):
+    """Opens and fully loads many databases in parallel.
+
+    Yields an :class:`OpenResult` for each target as soon as it's
+    done, so results are not in the order of targets. A failing
+    target doesn't affect the others, its exception is reported as
+    the error of its result.
+
+    :param targets: Iterable of dicts with the keyword arguments for
+      :func:`dbschema.open`, including ``backend``.
+    :param workers: Number of worker threads (default: ``4``). Each
+      worker uses one connection at a time, so this is the maximum
+      number of concurrent connections.
+    :param snapshots: If ``True`` snapshot data (see
+      :func:`dbschema.snapshot.dumps`) is returned instead of
+      :class:`~dbschema.objects.Database` instances.
+
+    Connections opened from connect kwargs are closed once a database
+    is loaded. Returned databases reconnect when they need to run a
+    query.
+    """
+    targets = list(targets)
+    tasks = queue.Queue()
+    results = queue.Queue()
+    for target in targets:
+        tasks.put(target)
+
+    def work():
+        while True:
+            try:
+                target = tasks.get_nowait()
+            except queue.Empty:
+                return
+            results.put(_open_target(target, snapshots))
+
+    for _ in range(min(max(workers, 1), len(targets))):
+        thread = threading.Thread(target=work, name='dbschema-open-many')
+        thread.daemon = True
+        thread.start()
+    try:
+        for _ in targets:
+            yield results.get()
+    finally:
+        # Stop workers early if the caller is not interested anymore.
+        while True:
+            try:
+                tasks.get_nowait()
+            except queue.Empty:
+                break
+
+
+def _open_target(target, snapshots):
+    from . import open as open_db
+    kwargs = dict(target)
+    backend = kwargs.pop('backend', None)
+    db = None
+    try:
+        db = open_db(backend, **kwargs)
+        db.refresh_all()
+        if snapshots:
+            return OpenResult(target, snapshot.dumps(db), None)
+        return OpenResult(target, db, None)
+    except Exception as err:
+        return OpenResult(target, None, err)
+    finally:
+        if db is not None:
+            try:
+                db.close()
+            except Exception:
+                pass
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Reusing connections across Database instances."""
+
+import threading
+import time
+
+
+class ConnectionPool(object):
+    """Keeps idle connections for reuse by :func:`dbschema.open`.
+
+    Connections are pooled by backend and connect kwargs. A database
+    draws a connection when it first needs one and returns it on
+    :meth:`~dbschema.objects.Database.close`.
+
+    :param size: Maximum number of idle connections kept per backend
+      and connect kwargs (default: ``5``). Surplus connections are
+      closed.
+    :param idle_timeout: Seconds an idle connection is kept, ``None``
+      keeps connections forever (default: ``300``).
+    :param health_check: If ``True`` connections are checked with a
+      trivial query before they are reused (default: ``True``).
+    """
+
+    def __init__(self, size=5, idle_timeout=300, health_check=True):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get_key(self, db, connect_kwargs):
+        return (db.dbapi_module,
+                tuple(sorted((k, repr(v)) for k, v in connect_kwargs.items())))
+
+    def acquire(self, db, connect_kwargs):
+        """Returns a connection for db, either pooled or a new one."""
+        key = self._get_key(db, connect_kwargs)
+        while True:
+            with self._lock:
+                expired = self._pop_expired()
+                idle = self._idle.get(key)
+                conn = idle.pop()[0] if idle else None
+            for old in expired:
+                _close(old)
+            if conn is None:
+                return db.dbapi.connect(**connect_kwargs)
+            if not self.health_check or db._check_connection(conn):
+                return conn
+            _close(conn)
+
+    def release(self, db, connect_kwargs, conn):
+        """Returns conn to the pool."""
+        try:
+            # Don't leak open transactions to the next user.
+            conn.rollback()
+        except Exception:
+            _close(conn)
+            return
+        key = self._get_key(db, connect_kwargs)
+        with self._lock:
+            expired = self._pop_expired()
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append((conn, time.time()))
+            else:
+                expired.append(conn)
+        for conn in expired:
+            _close(conn)
+
+    def _pop_expired(self):
+        # Must be called with the lock held.
+        expired = []
+        if self.idle_timeout is None:
+            return expired
+        deadline = time.time() - self.idle_timeout
+        for key, idle in list(self._idle.items()):
+            keep = [item for item in idle if item[1] >= deadline]
+            expired.extend(item[0] for item in idle if item[1] < deadline)
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        return expired
+
+    def prune(self):
+        """Closes connections that were idle longer than idle_timeout."""
+        with self._lock:
+            expired = self._pop_expired()
+        for conn in expired:
+            _close(conn)
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for items in idle.values():
+            for conn, _ in items:
+                _close(conn)
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
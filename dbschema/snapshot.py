@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Snapshots of database object trees.
+
+A snapshot is a compact binary representation of a fully loaded
+:class:`~dbschema.objects.Database`. Loading a snapshot rebuilds the
+tree without connecting to the database.
+"""
+
+import io
+import pickle
+import struct
+import zlib
+
+from . import objects
+from .exceptions import DBSchemaError
+
+
+#: Version of the snapshot format.
+SNAPSHOT_VERSION = 1
+
+_MAGIC = b'DBSCHEMA-SNAPSHOT\n'
+_HEADER = struct.Struct('>H')
+
+
+class SnapshotDatabase(objects.Database):
+    """A database object tree loaded from a snapshot.
+
+    All objects are loaded, so refreshes are no-ops.
+    """
+
+    def __init__(self, name, server_info=None):
+        super(SnapshotDatabase, self).__init__(name)
+        self._server_info = server_info
+        self._default_namespace = None
+
+    @property
+    def connection(self):
+        raise DBSchemaError('Snapshots are not connected to a database.')
+
+    def get_server_info(self):
+        return self._server_info
+
+    def get_default_namespace(self):
+        return self._default_namespace
+
+
+class _Unpickler(pickle.Unpickler):
+    # Snapshots only contain builtin types, refuse everything else.
+
+    def find_class(self, module, name):
+        raise DBSchemaError('Invalid snapshot: unexpected %s.%s'
+                            % (module, name))
+
+
+def dumps(db):
+    """Returns a snapshot of db as bytes.
+
+    Types that are not loaded yet are refreshed before.
+    """
+    db.refresh_all()
+    nodes = list(db._walk())
+    index = dict((id(node), i) for i, node in enumerate(nodes))
+    index[id(db)] = -1
+    types = {}
+    rows = []
+    for node in nodes:
+        type_cls = node.__class__
+        type_name = type_cls.__name__
+        if getattr(objects, type_name, None) is not type_cls:
+            raise DBSchemaError('Cannot create snapshot of %r' % node)
+        if type_name not in types:
+            types[type_name] = (type_cls._fields, type_cls._ref_fields)
+        values = tuple(getattr(node, f) for f in type_cls._fields)
+        refs = []
+        for field in type_cls._ref_fields:
+            ref = getattr(node, field)
+            refs.append(-1 if ref is None else index[id(ref)])
+        rows.append((type_name, index[id(node.parent)], values,
+                     tuple(refs), node._extras))
+    try:
+        server_info = db.get_server_info()
+    except Exception:
+        server_info = None
+    default_ns = db.get_default_namespace()
+    payload = {
+        'backend': db.name,
+        'server_info': server_info,
+        'default_namespace': None if default_ns is None
+                             else index[id(default_ns)],
+        'types': types,
+        'nodes': rows,
+    }
+    data = pickle.dumps(payload, protocol=2)
+    return _MAGIC + _HEADER.pack(SNAPSHOT_VERSION) + zlib.compress(data)
+
+
+def check(data):
+    """Checks that data is a snapshot compatible with this version.
+
+    :returns: The snapshot version.
+    :raises: :exc:`dbschema.exceptions.DBSchemaError` if data isn't
+      a compatible snapshot.
+    """
+    if not data.startswith(_MAGIC):
+        raise DBSchemaError('Not a dbschema snapshot.')
+    offset = len(_MAGIC)
+    version, = _HEADER.unpack(data[offset:offset + _HEADER.size])
+    if version != SNAPSHOT_VERSION:
+        raise DBSchemaError(
+            'Snapshot version %d is not supported (expected %d).'
+            % (version, SNAPSHOT_VERSION))
+    return version
+
+
+def loads(data):
+    """Returns a :class:`SnapshotDatabase` from a snapshot.
+
+    :raises: :exc:`dbschema.exceptions.DBSchemaError` if data isn't
+      a compatible snapshot.
+    """
+    check(data)
+    try:
+        raw = zlib.decompress(data[len(_MAGIC) + _HEADER.size:])
+        payload = _Unpickler(io.BytesIO(raw)).load()
+    except (zlib.error, pickle.UnpicklingError, EOFError) as err:
+        raise DBSchemaError('Invalid snapshot: %s' % err)
+    db = SnapshotDatabase(payload['backend'], payload['server_info'])
+    types = {}
+    for type_name in payload['types']:
+        type_cls = getattr(objects, type_name, None)
+        if not (isinstance(type_cls, type)
+                and issubclass(type_cls, objects.Node)):
+            raise DBSchemaError('Invalid snapshot: unknown type %r'
+                                % type_name)
+        types[type_name] = (type_cls,) + tuple(payload['types'][type_name])
+    nodes = []
+    for type_name, _, values, _, extras in payload['nodes']:
+        type_cls, fields, _ = types[type_name]
+        kwargs = dict(zip(fields, values))
+        if extras:
+            kwargs.update(extras)
+        nodes.append(type_cls(**kwargs))
+    # References need to be set before the nodes are added to the
+    # tree, they're indexed by add_child().
+    for node, row in zip(nodes, payload['nodes']):
+        ref_fields = types[row[0]][2]
+        for field, ref in zip(ref_fields, row[3]):
+            setattr(node, field, None if ref == -1 else nodes[ref])
+    for node, row in zip(nodes, payload['nodes']):
+        parent = db if row[1] == -1 else nodes[row[1]]
+        parent.add_child(node)
+    if payload['default_namespace'] is not None:
+        db._default_namespace = nodes[payload['default_namespace']]
+    return db
+
+
+def save_snapshot(db, path):
+    """Writes a snapshot of db to path.
+
+    :param db: A :class:`dbschema.objects.Database` instance.
+    :param path: Name of the snapshot file.
+    """
+    data = dumps(db)
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+
+def open_snapshot(path):
+    """Returns a :class:`SnapshotDatabase` loaded from path.
+
+    :raises: :exc:`dbschema.exceptions.DBSchemaError` if the file
+      isn't a compatible snapshot.
+    """
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    return loads(data)
@@ -13,6 +13,9 @@ BackendConfig = namedtuple('BackendConfig', 'name kwargs')
 conf = None
 HERE = abspath(dirname(__file__))
 
+# asyncio tests need async/await syntax.
+collect_ignore = ['test_aio.py'] if sys.version_info < (3, 5) else []
+
 
 def _get_config():
     global conf
@@ -0,0 +1,94 @@
+"""Tests for the asyncio interface."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+import dbschema
+
+pytest.importorskip('aiosqlite')
+
+
+@pytest.fixture
+def dbfile(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        'create table t1 (id integer primary key, val text);'
+        'create table t2 (id integer primary key,'
+        '  t1_id integer references t1);'
+        'create view v1 as select id from t1;')
+    conn.close()
+    return path
+
+
+def test_open_async(dbfile):
+    async def run():
+        async with await dbschema.open_async(
+                dbschema.BACKEND_SQLITE3, database=dbfile) as adb:
+            tables = await adb.get_tables()
+            assert sorted(t.name for t in tables) == ['t1', 't2']
+            assert [v.name for v in await adb.get_views()] == ['v1']
+            t1 = adb.find_exact(type_cls=dbschema.objects.Table, name='t1')
+            t2 = adb.find_exact(type_cls=dbschema.objects.Table, name='t2')
+            columns, fks = await asyncio.gather(
+                adb.get_columns(t1), adb.get_foreign_keys(t2))
+            assert [c.name for c in columns] == ['id', 'val']
+            assert [fk.foreign_table for fk in fks] == [t1]
+            rfks = await adb.get_reverse_foreign_keys(t1)
+            assert [fk.parent for fk in rfks] == [t2]
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('scoped_refresh', [True, False])
+def test_concurrent_refreshes(dbfile, scoped_refresh):
+    async def run():
+        adb = await dbschema.open_async(
+            dbschema.BACKEND_SQLITE3, database=dbfile,
+            scoped_refresh=scoped_refresh, max_connections=3)
+        try:
+            tables = sorted(await adb.get_tables())
+            results = await asyncio.gather(
+                *[adb.get_columns(t) for t in tables + tables])
+            assert [[c.name for c in r] for r in results] == [
+                ['id', 'val'], ['id', 't1_id']] * 2
+            assert len(adb._own) <= 3
+            await adb.refresh_all()
+            assert not adb.db._dirty
+        finally:
+            await adb.close()
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_refresh_indexes(dbfile, bulk):
+    conn = sqlite3.connect(dbfile)
+    conn.executescript('create table t3 (a, b, unique (b, a));'
+                       'create index t3_a on t3 (a);')
+    conn.close()
+
+    async def run():
+        async with await dbschema.open_async(
+                dbschema.BACKEND_SQLITE3, database=dbfile) as adb:
+            adb.db._pragma_functions = bulk
+            t3 = adb.find_exact(type_cls=dbschema.objects.Table, name='t3')
+            await adb.refresh(t3, dbschema.objects.Index)
+            await adb.refresh(t3, dbschema.objects.UniqueConstraint)
+            indexes = sorted(t3.find(type_cls=dbschema.objects.Index))
+            assert [(i.name, i.columns) for i in indexes] == [
+                ('sqlite_autoindex_t3_1', ('b', 'a')), ('t3_a', ('a',))]
+            unique = t3.find_exact(type_cls=dbschema.objects.UniqueConstraint)
+            assert unique.columns == ('b', 'a')
+    asyncio.run(run())
+
+
+def test_open_async_invalid_backend():
+    with pytest.raises(dbschema.exceptions.DBSchemaError):
+        asyncio.run(dbschema.open_async('foo'))
+
+
+def test_numeric_params():
+    sql = "select * from t where a = %s and b like '%%x' and c = %s"
+    assert dbschema.aio._numeric_params(sql) == (
+        "select * from t where a = $1 and b like '%x' and c = $2")
@@ -1,5 +1,7 @@
 """API tests."""
 
+import time
+
 import pytest
 
 import dbschema
@@ -32,6 +34,55 @@ def test_open_connection_or_kwargs():
     dbschema.open(dbschema.BACKEND_SQLITE3, **kwargs)
 
 
+def test_close(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    with dbschema.open(dbschema.BACKEND_SQLITE3, database=path) as db:
+        conn = db.connection
+    assert db._conn is None
+    with pytest.raises(Exception):
+        conn.execute('select 1')
+    # The tree is still usable and reconnects.
+    assert list(db.get_tables()) == []
+
+
+def test_connection_pool(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    pool = dbschema.ConnectionPool(size=1)
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, pool=pool, database=path)
+    conn = db.connection
+    db.close()
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, pool=pool, database=path)
+    assert db.connection is conn
+    other = dbschema.open(dbschema.BACKEND_SQLITE3, pool=pool,
+                          database=path)
+    assert other.connection is not conn
+    db.close()
+    other.close()  # pool is full
+    assert len(pool._idle) == 1
+    # Broken connections are not reused.
+    conn.close()
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, pool=pool, database=path)
+    assert db.connection is not conn
+    db.close()
+    pool.idle_timeout = -1
+    pool.prune()
+    assert pool._idle == {}
+
+
+def test_connection_pool_idle_timeout(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    pool = dbschema.ConnectionPool(idle_timeout=0.01)
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, pool=pool, database=path)
+    conn = db.connection
+    db.close()
+    time.sleep(0.05)
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, pool=pool, database=path)
+    assert db.connection is not conn
+    with pytest.raises(Exception):
+        conn.execute('select 1')
+    db.close()
+
+
 # dbschema.objects.Node
 
 def test_nodes_sort_by_name():
@@ -41,6 +92,32 @@ def test_nodes_sort_by_name():
     assert sorted([v1, t2, t1]) == [t2, v1, t1]
 
 
+def test_node_identity():
+    t1 = dbschema.objects.Table(name='foo', oid=1)
+    t2 = dbschema.objects.Table(name='bar', oid=1)
+    v1 = dbschema.objects.View(name='foo', oid=1)
+    assert t1 == t2
+    assert hash(t1) == hash(t2)
+    assert t1 != v1
+    assert len(set([t1, t2, v1])) == 2
+    assert t1._get_identity() is t1._get_identity()
+    db = dbschema.objects.Database(name='test')
+    c1 = db.add_child(dbschema.objects.Column(name='foo'))
+    c2 = db.add_child(dbschema.objects.Column(name='bar'))
+    assert c1 != c2
+    assert c1 == dbschema.objects.Column(name='foo', parent=db)
+
+
+def test_node_extras():
+    t = dbschema.objects.Table(name='foo', createstatement='CREATE ...')
+    assert t.createstatement == 'CREATE ...'
+    assert t.extras == {'createstatement': 'CREATE ...'}
+    assert not hasattr(t, '__dict__')
+    with pytest.raises(AttributeError):
+        t.foo
+    assert dbschema.objects.Column(name='bar').children == []
+
+
 def test_get_child_types():
     db = dbschema.objects.Database(name="test")
     node = dbschema.objects.Node(name="foo")
@@ -55,6 +132,99 @@ def test_get_child_types():
     assert t1.get_child_types() == set([dbschema.objects.Column])
 
 
+def _build_tree():
+    db = dbschema.objects.Database(name='test')
+    nsp = db.add_child(dbschema.objects.Namespace(name='public', oid=1))
+    other = db.add_child(dbschema.objects.Namespace(name='other', oid=2))
+    t1 = nsp.add_child(dbschema.objects.Table(name='foo', oid=3))
+    t2 = other.add_child(dbschema.objects.Table(name='foo', oid=4))
+    t1.add_child(dbschema.objects.Column(name='id', oid=5))
+    t2.add_child(dbschema.objects.Column(name='id', oid=6))
+    return db, nsp, other, t1, t2
+
+
+def test_find_uses_indexes():
+    db, nsp, other, t1, t2 = _build_tree()
+    assert set(db.find(type_cls=dbschema.objects.Table)) == set([t1, t2])
+    assert set(db.find(name='foo')) == set([t1, t2])
+    assert list(db.find(parent=nsp)) == [t1]
+    assert list(db.find(type_cls=dbschema.objects.Namespace,
+                        recurse=False, name='other')) == [other]
+    assert list(db.find(type_cls=dbschema.objects.Table, oid=4)) == [t2]
+    assert set(db.find(type_cls=dbschema.objects.Node)) == set(db.find())
+    # Columns are not in the type and name indexes but still found.
+    Column = dbschema.objects.Column
+    assert 'id' not in [name for _, name in db._name_idx]
+    assert [c.oid for c in db.find(type_cls=Column)] == [5, 6]
+    assert [c.oid for c in db.find(name='id')] == [5, 6]
+    assert [c.oid for c in t1.find(type_cls=Column, name='id')] == [5]
+
+
+def test_find_limited_to_subtree():
+    db, nsp, other, t1, t2 = _build_tree()
+    assert list(nsp.find(type_cls=dbschema.objects.Table)) == [t1]
+    assert list(nsp.find(parent=t2)) == []
+    assert [c.oid for c in other.find(parent=t2)] == [6]
+    assert list(nsp.find(recurse=False, name='id')) == []
+
+
+def test_find_by_name_in_subtree():
+    db, nsp, other, t1, t2 = _build_tree()
+    Table = dbschema.objects.Table
+    # Answered from the name index instead of walking the namespace.
+    assert nsp._find_indexed(Table, 'foo', None, True) is not None
+    assert list(nsp.find(type_cls=Table, name='foo')) == [t1]
+    assert [c.oid for c in other.find(name='id')] == [6]
+    assert list(nsp.find(name='public')) == []
+
+
+def test_find_exact():
+    db, nsp, other, t1, t2 = _build_tree()
+    assert db.find_exact(type_cls=dbschema.objects.Table, name='foo') is None
+    assert nsp.find_exact(type_cls=dbschema.objects.Table, name='foo') is t1
+    assert db.find_exact(type_cls=dbschema.objects.Namespace,
+                         name='public') is nsp
+
+
+def test_reverse_foreign_key_index():
+    db, nsp, other, t1, t2 = _build_tree()
+    fk = t2.add_child(dbschema.objects.ForeignKey(
+        name='fk', oid=7, foreign_table=t1))
+    assert list(t1.get_reverse_foreign_keys()) == [fk]
+    assert list(t2.get_reverse_foreign_keys()) == []
+
+
+def test_children_ordered_and_replaced():
+    db, nsp, other, t1, t2 = _build_tree()
+    for name in ('b', 'a', 'c'):
+        t1.add_child(dbschema.objects.Column(name=name, oid='t1.' + name))
+    assert [c.name for c in t1.children] == ['id', 'b', 'a', 'c']
+    new = t1.add_child(dbschema.objects.Column(name='B', oid='t1.b'))
+    assert [c.name for c in t1.children] == ['id', 'B', 'a', 'c']
+    assert t1.get_child(oid='t1.b', type_cls=dbschema.objects.Column) is new
+    assert db.find_by_oid('t1.b') is new
+    assert db.find_exact(type_cls=dbschema.objects.Column, name='b') is None
+
+
+def test_replace_keeps_children():
+    db, nsp, other, t1, t2 = _build_tree()
+    new = nsp.add_child(dbschema.objects.Table(name='foo2', oid=3))
+    assert [c.oid for c in new.children] == [5]
+    assert new.children[0].parent is new
+    assert list(nsp.find(type_cls=dbschema.objects.Table)) == [new]
+
+
+def test_remove_child():
+    db, nsp, other, t1, t2 = _build_tree()
+    nsp.remove_child(t1)
+    assert nsp.get_child_types() == set()
+    assert db.find_by_oid(3) is None
+    assert db.find_by_oid(5) is None
+    assert list(db.find(type_cls=dbschema.objects.Table)) == [t2]
+    with pytest.raises(dbschema.exceptions.DBSchemaError):
+        nsp.remove_child(t1)
+
+
 # dbschema.objects.Database
 
 def test_db_get_server_info(db):
@@ -70,6 +240,283 @@ def test_get_views(db):
     assert [t.name for t in db.get_views()] == ['view1']
 
 
+def _open_sqlite(**kwargs):
+    sqlite3 = pytest.importorskip('sqlite3')
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(
+        'create table t1 (id integer primary key, val text);'
+        'create table t2 (id integer primary key,'
+        '  t1_id integer references t1);')
+    return dbschema.open(dbschema.BACKEND_SQLITE3, conn, **kwargs)
+
+
+def test_scoped_refresh():
+    db = _open_sqlite(scoped_refresh=True)
+    t1 = db.find_exact(type_cls=dbschema.objects.Table, name='t1')
+    t2 = db.find_exact(type_cls=dbschema.objects.Table, name='t2')
+    assert [c.name for c in t1.get_columns()] == ['id', 'val']
+    assert t2.children == []
+    assert dbschema.objects.Column in db._dirty
+    assert len(list(t2.get_foreign_keys())) == 1
+    assert [c.name for c in t2.get_columns()] == ['id', 't1_id']
+    assert len(list(t1.get_reverse_foreign_keys())) == 1
+    assert dbschema.objects.ForeignKey not in db._dirty
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_sqlite_bulk_pragmas(bulk):
+    db = _open_sqlite()
+    db._pragma_functions = bulk
+    t1 = db.find_exact(type_cls=dbschema.objects.Table, name='t1')
+    t2 = db.find_exact(type_cls=dbschema.objects.Table, name='t2')
+    assert [c.name for c in t2.get_columns()] == ['id', 't1_id']
+    fks = list(t1.get_reverse_foreign_keys())
+    assert [fk.parent for fk in fks] == [t2]
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_column_metadata(bulk):
+    db = _open_sqlite()
+    db.connection.execute(
+        "create table t3 (a varchar(10) not null default 'x', b)")
+    db.sync()
+    db._pragma_functions = bulk
+    t3 = db.find_exact(type_cls=dbschema.objects.Table, name='t3')
+    a, b = t3.get_columns()
+    assert (a.data_type, a.nullable, a.default, a.position) == (
+        'varchar(10)', False, "'x'", 1)
+    assert (b.data_type, b.nullable, b.default, b.position) == (
+        '', True, None, 2)
+    snapshot = dbschema.snapshot.loads(dbschema.snapshot.dumps(db))
+    col = snapshot.find_exact(type_cls=dbschema.objects.Column, name='a')
+    assert col.data_type == 'varchar(10)'
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+@pytest.mark.parametrize('scoped', [True, False])
+def test_sqlite_keys_and_indexes(bulk, scoped):
+    db = _open_sqlite(scoped_refresh=scoped)
+    db.connection.executescript(
+        'create table t3 (a, b, c, primary key (b, a), unique (c, a));'
+        'create index t3_c on t3 (c desc, b);')
+    db.sync()
+    db._pragma_functions = bulk
+    t1 = db.find_exact(type_cls=dbschema.objects.Table, name='t1')
+    t3 = db.find_exact(type_cls=dbschema.objects.Table, name='t3')
+    assert t1.get_primary_key().columns == ('id',)
+    assert list(t1.get_indexes()) == []
+    assert t3.get_primary_key().columns == ('b', 'a')
+    indexes = dict((i.name, i) for i in t3.get_indexes())
+    assert indexes['t3_c'].columns == ('c', 'b')
+    assert not indexes['t3_c'].unique
+    uniques = list(t3.get_unique_constraints())
+    assert [u.columns for u in uniques] == [('c', 'a')]
+    assert indexes[uniques[0].name].unique
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_parallel_refresh(tmpdir, bulk):
+    sqlite3 = pytest.importorskip('sqlite3')
+    path = str(tmpdir.join('test.db'))
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        'create table t1 (id integer primary key, val text);'
+        'create table t2 (id integer primary key,'
+        '  t1_id integer references t1);')
+    conn.close()
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, database=path,
+                       refresh_workers=3)
+    db._pragma_functions = bulk
+    db.refresh_all()
+    assert not db._dirty
+    assert 1 <= len(db._worker_conns) <= 2
+    t1 = db.find_exact(type_cls=dbschema.objects.Table, name='t1')
+    t2 = db.find_exact(type_cls=dbschema.objects.Table, name='t2')
+    assert [c.name for c in t1.get_columns()] == ['id', 'val']
+    assert [c.name for c in t2.get_columns()] == ['id', 't1_id']
+    assert [fk.parent for fk in t1.get_reverse_foreign_keys()] == [t2]
+
+
+def test_instrumentation_hook():
+    events = []
+    counters = dbschema.instrumentation.Counters()
+
+    class Hook(dbschema.instrumentation.CallbackHook):
+        def on_query(self, *args):
+            super(Hook, self).on_query(*args)
+            counters.on_query(*args)
+
+        def on_phase(self, *args):
+            super(Hook, self).on_phase(*args)
+            counters.on_phase(*args)
+
+    db = _open_sqlite(hook=Hook(events.append))
+    db.refresh_all()
+    queries = [e for e in events if e['event'] == 'query']
+    phases = [e for e in events if e['event'] == 'phase']
+    assert [e['phase'] for e in phases] == ['initialize', 'refresh_types']
+    assert phases[0]['nodes'] == 2
+    assert phases[1]['nodes'] == 7
+    assert sum(e['queries'] for e in phases) == len(queries)
+    assert sum(e['rows'] for e in queries) == sum(e['rows'] for e in phases)
+    assert all(e['seconds'] >= 0 for e in events)
+    assert counters.get('queries_total', backend='sqlite3') == len(queries)
+    assert counters.get('nodes_created_total', backend='sqlite3',
+                        phase='refresh_types') == 7
+    assert ('dbschema_phases_total{backend="sqlite3",phase="initialize"} 1'
+            in counters.render().splitlines())
+
+
+def test_refresh_dirty_object():
+    db = _open_sqlite()
+    t1 = db.find_exact(type_cls=dbschema.objects.Table, name='t1')
+    assert len(list(t1.get_columns())) == 2
+    db.connection.execute('alter table t1 add column val2 text')
+    assert len(list(t1.get_columns())) == 2
+    db.set_dirty(dbschema.objects.Column, True, obj=t1)
+    assert dbschema.objects.Column not in db._dirty
+    assert [c.name for c in t1.get_columns()] == ['id', 'val', 'val2']
+
+
+def test_sync():
+    db = _open_sqlite()
+    t1 = db.find_exact(type_cls=dbschema.objects.Table, name='t1')
+    assert len(list(t1.get_reverse_foreign_keys())) == 1
+    assert len(list(t1.get_columns())) == 2
+    assert db.sync() == ([], [], [])
+    db.connection.executescript(
+        'alter table t1 add column val2 text;'
+        'create table t3 (id integer primary key);'
+        'drop table t2;')
+    added, removed, changed = db.sync()
+    assert [o.name for o in added] == ['t3']
+    assert [o.name for o in removed] == ['t2']
+    assert changed == [t1]
+    assert db.find_exact(type_cls=dbschema.objects.Table, name='t2') is None
+    assert 'val2' in t1.createstatement
+    assert [c.name for c in t1.get_columns()] == ['id', 'val', 'val2']
+    assert list(t1.get_reverse_foreign_keys()) == []
+    t3 = db.find_exact(type_cls=dbschema.objects.Table, name='t3')
+    assert [c.name for c in t3.get_columns()] == ['id']
+
+
+def test_sync_indexes():
+    db = _open_sqlite()
+    t1 = db.find_exact(type_cls=dbschema.objects.Table, name='t1')
+    assert list(t1.get_indexes()) == []
+    db.connection.execute('create index t1_val on t1 (val)')
+    assert db.sync() == ([], [], [t1])
+    assert [i.columns for i in t1.get_indexes()] == [('val',)]
+    db.connection.execute('drop index t1_val')
+    assert db.sync() == ([], [], [t1])
+    assert list(t1.get_indexes()) == []
+
+
+# snapshots
+
+def test_snapshot_roundtrip(db, tmpdir):
+    path = str(tmpdir.join('schema.snapshot'))
+    dbschema.save_snapshot(db, path)
+    snap = dbschema.open_snapshot(path)
+    assert snap.name == db.name
+    assert snap.get_server_info() == db.get_server_info()
+    assert (set(t.name for t in snap.get_tables())
+            == set(t.name for t in db.get_tables()))
+    t1 = snap.find_exact(type_cls=dbschema.objects.Table, name='table1')
+    assert [c.name for c in t1.get_columns()] == ['id', 'val1', 'val2']
+    fks = list(t1.get_reverse_foreign_keys())
+    assert len(fks) == 1
+    assert fks[0].parent.name == 'table2'
+    assert fks[0].foreign_table is t1
+    ns = snap.get_default_namespace()
+    if ns is not None:
+        assert ns.name == db.get_default_namespace().name
+
+
+def test_snapshot_keeps_extras(tmpdir):
+    db = _open_sqlite()
+    path = str(tmpdir.join('schema.snapshot'))
+    dbschema.save_snapshot(db, path)
+    snap = dbschema.open_snapshot(path)
+    t1 = snap.find_exact(type_cls=dbschema.objects.Table, name='t1')
+    assert t1.createstatement.startswith('CREATE TABLE t1')
+    with pytest.raises(dbschema.exceptions.DBSchemaError):
+        snap.connection
+
+
+def test_snapshot_incompatible(tmpdir):
+    db = _open_sqlite()
+    data = dbschema.snapshot.dumps(db)
+    assert dbschema.snapshot.check(data) == dbschema.snapshot.SNAPSHOT_VERSION
+    with pytest.raises(dbschema.exceptions.DBSchemaError):
+        dbschema.snapshot.loads(b'foo' + data)
+    version = dbschema.snapshot._HEADER.pack(
+        dbschema.snapshot.SNAPSHOT_VERSION + 1)
+    offset = len(dbschema.snapshot._MAGIC)
+    broken = data[:offset] + version + data[offset + len(version):]
+    with pytest.raises(dbschema.exceptions.DBSchemaError):
+        dbschema.snapshot.loads(broken)
+
+
+# dbschema.open_many
+
+@pytest.mark.parametrize('snapshots', [True, False])
+def test_open_many(tmpdir, snapshots):
+    sqlite3 = pytest.importorskip('sqlite3')
+    targets = []
+    for i in range(3):
+        path = str(tmpdir.join('db%d.sqlite' % i))
+        conn = sqlite3.connect(path)
+        conn.execute('create table t%d (id integer primary key)' % i)
+        conn.close()
+        targets.append({'backend': dbschema.BACKEND_SQLITE3,
+                        'database': path})
+    targets.append({'backend': 'foo'})
+    results = list(dbschema.open_many(targets, workers=2,
+                                      snapshots=snapshots))
+    assert len(results) == 4
+    failed = [r for r in results if r.error is not None]
+    assert [r.target for r in failed] == [{'backend': 'foo'}]
+    assert isinstance(failed[0].error, dbschema.exceptions.DBSchemaError)
+    for result in results:
+        if result.error is not None:
+            continue
+        db = result.db
+        if snapshots:
+            db = dbschema.snapshot.loads(db)
+        assert not db._dirty
+        i = targets.index(result.target)
+        table = db.find_exact(type_cls=dbschema.objects.Table)
+        assert table.name == 't%d' % i
+        assert [c.name for c in table.find(type_cls=dbschema.objects.Column)
+                ] == ['id']
+
+
+# dbschema.diff
+
+def test_diff():
+    db_a = _open_sqlite()
+    db_b = _open_sqlite()
+    db_b.connection.executescript(
+        'drop table t2;'
+        'create table t2 (id integer primary key, t1_id integer,'
+        '  t3_id integer references t3);'
+        'create table t3 (id integer primary key);')
+    db_b.sync()
+    result = dbschema.diff(db_a, db_b)
+    assert sorted((n.__class__.__name__, n.name) for n in result.added) == [
+        ('Column', 'id'), ('Column', 't3_id'), ('ForeignKey', 't2.t3_id'),
+        ('PrimaryKey', 'pk_t3'), ('Table', 't3')]
+    assert [(n.__class__.__name__, n.name) for n in result.removed] == [
+        ('ForeignKey', 't2.t1_id')]
+    assert [(a.name, b.name) for a, b in result.changed] == [('t2', 't2')]
+    tables = dbschema.diff(db_a, db_b, types=[dbschema.objects.Table])
+    assert [n.name for n in tables.added] == ['t3']
+    assert tables.removed == []
+    snapshot = dbschema.snapshot.loads(dbschema.snapshot.dumps(db_a))
+    assert dbschema.diff(snapshot, db_a) == ([], [], [])
+
+
 # dbschema.objects.Namespace
 def test_namespace_is_default(db):
     ns = db.get_default_namespace()
@@ -84,7 +531,7 @@ class TestTable:
     def test_table_get_columns(self, db):
         t = db.find_exact(type_cls=dbschema.objects.Table, name='table1')
         assert t is not None
-        assert sorted(c.name for c in t.get_columns()) == ['id', 'val1', 'val2']
+        assert [c.name for c in t.get_columns()] == ['id', 'val1', 'val2']
 
     def test_get_foreignkeys(self, db):
         t = db.find_exact(type_cls=dbschema.objects.Table, name='table2')
@@ -107,7 +554,7 @@ class TestTable:
 def test_view_get_columns(db):
     v = db.find_exact(type_cls=dbschema.objects.View, name='view1')
     assert v is not None
-    assert sorted(c.name for c in v.get_columns()) == ['id', 'val2']
+    assert [c.name for c in v.get_columns()] == ['id', 'val2']
 
 
 # dbschema.objects.ForeignKey
@@ -1,6 +1,7 @@
 import pytest
 
 import dbschema
+from dbschema.backends.base import Loader
 
 
 def test_get_backend_fails_on_broken_backend():
@@ -10,3 +11,302 @@ def test_get_backend_fails_on_broken_backend():
             dbschema.backends.get_backend('invalid')
     finally:
         del dbschema.backends._BACKENDS['invalid']
+
+
+def test_query_results():
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, database=':memory:',
+                       fetch_size=2)
+    assert list(db.run_query('create table foo (a, b)')) == []
+    for i in range(5):
+        list(db.run_query('insert into foo values (?, ?)', (i, str(i))))
+    rows = list(db.iter_query('select a, b from foo order by a'))
+    assert rows == [(i, str(i)) for i in range(5)]
+    assert list(db.run_query('select a, b from foo where a = 1')) == [
+        {'a': 1, 'b': '1'}]
+
+
+def test_query_closes_cursor():
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, database=':memory:')
+    cursors = []
+    get_cursor = db.get_cursor
+
+    def tracking_cursor(**kwargs):
+        cursors.append(get_cursor(**kwargs))
+        return cursors[-1]
+    db.get_cursor = tracking_cursor
+    rows = db.iter_query('select 1 union all select 2')
+    assert next(rows) == (1,)
+    rows.close()
+    sqlite3 = pytest.importorskip('sqlite3')
+    with pytest.raises(sqlite3.ProgrammingError):
+        cursors[0].execute('select 1')
+
+
+def test_parallel_refresh_uses_query_path(tmpdir):
+    sqlite3 = pytest.importorskip('sqlite3')
+    path = str(tmpdir.join('test.db'))
+    conn = sqlite3.connect(path)
+    conn.executescript('create table t1 (a, b); create table t2 (c)')
+    conn.close()
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, database=path,
+                       refresh_workers=2, fetch_size=1)
+    conns = []
+    get_cursor = db.get_cursor
+
+    def tracking_cursor(**kwargs):
+        conns.append(kwargs.get('connection'))
+        return get_cursor(**kwargs)
+    db.get_cursor = tracking_cursor
+    db.refresh_types([dbschema.objects.Column, dbschema.objects.ForeignKey])
+    # One of the queries ran on a worker connection.
+    assert set(conns) == set([None, db._worker_conns[0]])
+    t1 = db.find_exact(type_cls=dbschema.objects.Table, name='t1')
+    assert [c.name for c in t1.get_columns()] == ['a', 'b']
+    db.close()
+
+
+def test_query_server_side_fallback():
+    # SQLite has no server-side cursors, large queries still work.
+    db = dbschema.open(dbschema.BACKEND_SQLITE3, database=':memory:',
+                       server_side_cursors=True, itersize=2)
+    sql = 'select 1 union all select 2 union all select 3'
+    assert list(db.iter_query(sql, large=True)) == [(1,), (2,), (3,)]
+    assert list(db.iter_query('create table foo (a)', large=True)) == []
+
+
+def test_postgresql_system_namespaces():
+    # Only checks the generated SQL, no server needed.
+    db_cls = dbschema.backends.get_backend(dbschema.BACKEND_POSTGRESQL)
+    db = db_cls(dbschema.BACKEND_POSTGRESQL, system_namespaces=False)
+    loaders = db._get_initial_loaders()
+    assert len(loaders) == 2
+    for loader in loaders + db._get_refresh_loaders(set(db.scoped_types)):
+        assert 'pg_proc' not in loader.sql
+        assert loader.sql.count('%s') == len(loader.params)
+        assert 'pg\\_toast%' in loader.params
+    db = db_cls(dbschema.BACKEND_POSTGRESQL)
+    assert db._get_initial_loaders()[0].params is None
+
+
+def test_postgresql_track_changes():
+    Namespace, Table = dbschema.objects.Namespace, dbschema.objects.Table
+    db_cls = dbschema.backends.get_backend(dbschema.BACKEND_POSTGRESQL)
+    db = db_cls(dbschema.BACKEND_POSTGRESQL)
+    # Opening reads only pg_namespace and pg_class by default.
+    loaders = db._get_initial_loaders()
+    assert len(loaders) == 2
+    assert 'pg_attribute' not in loaders[1].sql
+    db = db_cls(dbschema.BACKEND_POSTGRESQL, track_changes=True)
+    nsp_loader, token_loader, rel_loader = db._get_initial_loaders()
+    for catalog in ('pg_attribute', 'pg_attrdef', 'pg_constraint',
+                    'pg_index'):
+        assert catalog in token_loader.sql
+    nsp_loader.consume([(1, 'public', 'n1')])
+    token_loader.consume([(2, 'x')])
+    rel_loader.consume([(2, 1, 't1', None, 'r', 'a')])
+    # A renamed column leaves the pg_class row untouched.
+    rows = list(db._iter_namespaces([(1, 'public', 'n1')]))
+    token_loader.consume([(2, 'y')])
+    rows.extend(db._iter_relations([(2, 1, 't1', None, 'r', 'a')]))
+    assert db._sync_nodes((Namespace, Table), rows) == (
+        [], [], [db.find_by_oid(2)])
+
+
+@pytest.mark.parametrize('name', ['mysql', 'postgresql'])
+def test_namespace_filters(name):
+    db_cls = dbschema.backends.get_backend(name)
+    db = db_cls(name, namespaces=['app_*', 'x?'],
+                exclude_namespaces=['app_tmp%'])
+    where, params = db._namespace_filter('nsp')
+    assert where == (' AND (nsp LIKE %s OR nsp LIKE %s)'
+                     ' AND nsp NOT LIKE %s')
+    assert params == ['app\\_%', 'x_', 'app\\_tmp\\%']
+    loaders = db._get_initial_loaders() + db._get_refresh_loaders(
+        set(db.scoped_types))
+    for loader in loaders:
+        assert loader.sql.count('%s') == len(loader.params)
+    nsp = db.add_child(dbschema.objects.Namespace('app_1', oid='app_1'))
+    table = nsp.add_child(dbschema.objects.Table('t', oid='t'))
+    for type_cls in db.scoped_types:
+        for loader in db._get_object_loaders(table, type_cls):
+            assert loader.sql.count('%s') == len(loader.params)
+
+
+def test_default_namespace_cache():
+    sqlite3 = pytest.importorskip('sqlite3')
+    Namespace = dbschema.objects.Namespace
+    base_cls = dbschema.backends.get_backend(dbschema.BACKEND_SQLITE3)
+
+    class Database(base_cls):
+        def _get_default_namespace_loader(self):
+            return Loader("select 'ns'", None, self._load, False)
+
+        def _load(self, rows):
+            name = list(rows)[0][0]
+            return self.find_exact(type_cls=Namespace, name=name)
+
+    events = []
+    db = Database(dbschema.BACKEND_SQLITE3)
+    db.hook = dbschema.instrumentation.CallbackHook(events.append)
+    db.set_connection(sqlite3.connect(':memory:'))
+    nsp = db.add_child(Namespace('ns', oid=1))
+    assert db.get_default_namespace() is nsp
+    assert nsp.is_default_namespace()
+    assert len(events) == 1
+    db.add_child(Namespace('other', oid=2))
+    assert db.get_default_namespace() is nsp
+    assert len(events) == 2
+    db.invalidate_default_namespace()
+    assert db.get_default_namespace() is nsp
+    assert len(events) == 3
+
+
+def test_mysql_composite_foreign_keys():
+    # Loads rows as returned by SQL_FKS, no server needed.
+    db_cls = dbschema.backends.get_backend(dbschema.BACKEND_MYSQL)
+    db = db_cls(dbschema.BACKEND_MYSQL)
+    nsp = db.add_child(dbschema.objects.Namespace('App', oid='app'))
+    t1 = nsp.add_child(dbschema.objects.Table('T1', oid='app.t1'))
+    t2 = nsp.add_child(dbschema.objects.Table('T2', oid='app.t2'))
+    loader = db._get_constraints_loader(t2)
+    assert loader.sql.count('%s') == len(loader.params)
+    assert "'#fk/'" in loader.sql
+    loader.consume([('app#fk/t1', 't1', 'app.t2', 'app.t1', 'a,b',
+                     'x,y')])
+    fks = list(t2.find(type_cls=dbschema.objects.ForeignKey))
+    assert len(fks) == 1
+    # The constraint is named like the referenced table.
+    assert db.find_by_oid('app.t1') is t1
+    assert fks[0].foreign_table is t1
+    assert fks[0].columns == ('a', 'b')
+    assert fks[0].foreign_columns == ('x', 'y')
+
+
+def test_mysql_keys():
+    # Loads rows as returned by SQL_INDEXES, no server needed.
+    db_cls = dbschema.backends.get_backend(dbschema.BACKEND_MYSQL)
+    db = db_cls(dbschema.BACKEND_MYSQL)
+    nsp = db.add_child(dbschema.objects.Namespace('App', oid='app'))
+    t1 = nsp.add_child(dbschema.objects.Table('T1', oid='app.t1'))
+    loader = db._get_keys_loader(
+        [dbschema.objects.PrimaryKey, dbschema.objects.UniqueConstraint], t1)
+    assert loader.sql.count('%s') == len(loader.params)
+    loader.consume([('app.t1', 'PRIMARY', 1, 'a,b'),
+                    ('app.t1', 'uq_c', 1, 'c'),
+                    ('app.t1', 'ix_d', 0, 'd')])
+    pk = t1.find_exact(type_cls=dbschema.objects.PrimaryKey)
+    assert pk.columns == ('a', 'b')
+    assert [u.name for u in t1.find(
+        type_cls=dbschema.objects.UniqueConstraint)] == ['uq_c']
+    assert list(t1.find(type_cls=dbschema.objects.Index)) == []
+    loader = db._get_keys_loader([dbschema.objects.Index])
+    loader.consume([('app.t1', 'ix_d', 0, None)])
+    index = t1.find_exact(type_cls=dbschema.objects.Index)
+    assert (index.name, index.columns, index.unique) == ('ix_d', (), False)
+
+
+def test_postgresql_constraint_types():
+    db_cls = dbschema.backends.get_backend(dbschema.BACKEND_POSTGRESQL)
+    db = db_cls(dbschema.BACKEND_POSTGRESQL)
+    loaders = db._get_refresh_loaders(set([
+        dbschema.objects.ForeignKey, dbschema.objects.PrimaryKey]))
+    assert len(loaders) == 1
+    assert "con.contype in ('f', 'p')" in loaders[0].sql
+    nsp = db.add_child(dbschema.objects.Namespace('public', oid=1))
+    t1 = nsp.add_child(dbschema.objects.Table('t1', oid=2))
+    loaders[0].consume([(3, 'p', 't1_pkey', 2, 0, None, ['id'], None)])
+    pk = t1.find_exact(type_cls=dbschema.objects.PrimaryKey)
+    assert pk.columns == ('id',)
+
+
+def test_postgresql_refresh_relations():
+    # Loads rows as returned by the catalog queries, no server needed.
+    Table = dbschema.objects.Table
+    db_cls = dbschema.backends.get_backend(dbschema.BACKEND_POSTGRESQL)
+    db = db_cls(dbschema.BACKEND_POSTGRESQL)
+    nsp_loader, rel_loader = db._get_initial_loaders()
+    nsp_loader.consume([(1, 'public', 'n1')])
+    rel_loader.consume([(2, 1, 't1', None, 'r', 'a'),
+                        (3, 1, 't2', None, 'r', 'b'),
+                        (4, 1, 't3', None, 'r', 'c')])
+    t1 = db.find_by_oid(2)
+    db._get_constraints_loader([dbschema.objects.ForeignKey]).consume(
+        [(5, 'f', 'fk', 3, 2, None, ['t1_id'], ['id'])])
+    db.set_dirty(Table, True)
+    loaders = db._get_refresh_loaders(db._take_dirty_types([Table]))
+    assert len(loaders) == 1
+    loaders[0].consume([(2, 1, 't1', None, 'r', 'a'),
+                        (3, 1, 't2', None, 'r', 'b')])
+    assert db.find_by_oid(2) is t1
+    assert db.find_by_oid(4) is None
+    fk = db.find_by_oid(5)
+    assert fk.foreign_table is t1
+    for type_cls in list(db._dirty):
+        db.set_dirty(type_cls, False)
+    db._default_ns_cache = None  # resolving it needs a connection
+    snapshot = dbschema.snapshot.loads(dbschema.snapshot.dumps(db))
+    assert snapshot.find_by_oid(5).foreign_table is snapshot.find_by_oid(2)
+
+
+def test_postgresql_sync_namespace_token():
+    # A GRANT on a schema changes its token, not those of its tables.
+    Namespace, Table = dbschema.objects.Namespace, dbschema.objects.Table
+    db_cls = dbschema.backends.get_backend(dbschema.BACKEND_POSTGRESQL)
+    db = db_cls(dbschema.BACKEND_POSTGRESQL)
+    nsp_loader, rel_loader = db._get_initial_loaders()
+    namespaces = [(1, 'public', 'n1'), (2, 'other', 'n2')]
+    relations = [(3, 1, 't1', None, 'r', 'a'), (4, 2, 't2', None, 'r', 'b')]
+    nsp_loader.consume(namespaces)
+    rel_loader.consume(relations)
+    t1 = db.find_by_oid(3)
+    db._get_constraints_loader([dbschema.objects.ForeignKey]).consume(
+        [(5, 'f', 'fk', 4, 3, None, ['t1_id'], ['id'])])
+    namespaces[0] = (1, 'public', 'n1-granted')
+    rows = list(db._iter_namespaces(namespaces))
+    rows.extend(db._iter_relations(relations))
+    result = db._sync_nodes((Namespace, Table), rows)
+    assert result == ([], [], [db.find_by_oid(1)])
+    assert db.find_by_oid(3) is t1
+    assert t1.parent is db.find_by_oid(1)
+    assert db.find_by_oid(5).foreign_table is t1
+
+
+def test_mysql_initial_loaders():
+    db_cls = dbschema.backends.get_backend(dbschema.BACKEND_MYSQL)
+    db = db_cls(dbschema.BACKEND_MYSQL)
+    loaders = db._get_initial_loaders()
+    assert len(loaders) == 2
+    assert not any('information_schema.columns' in l.sql for l in loaders)
+    assert 'information_schema.views' in loaders[1].sql
+    assert 'information_schema.statistics' not in loaders[1].sql
+    loaders[0].consume([('app', 'App')])
+    loaders[1].consume([('app.t1', 'T1', '', 'BASE TABLE', 'app', None),
+                        ('app.v1', 'V1', '', 'VIEW', 'app', None)])
+    assert [n.name for n in db.find()] == ['App', 'T1', 'V1']
+    assert db._dirty == set(db.scoped_types)
+    # Refreshes keep unchanged nodes and remove dropped ones.
+    t1 = db.find_by_oid('app.t1')
+    db.set_dirty(dbschema.objects.Table, True)
+    db.set_dirty(dbschema.objects.View, True)
+    loaders = db._get_refresh_loaders(db._take_dirty_types(
+        [dbschema.objects.Table, dbschema.objects.View]))
+    loaders[0].consume([('app.t1', 'T1', '', 'BASE TABLE', 'app', None)])
+    assert db.find_by_oid('app.t1') is t1
+    assert db.find_by_oid('app.v1') is None
+
+
+def test_mysql_track_changes():
+    Table = dbschema.objects.Table
+    db_cls = dbschema.backends.get_backend(dbschema.BACKEND_MYSQL)
+    db = db_cls(dbschema.BACKEND_MYSQL, track_changes=True)
+    nsp_loader, token_loader, rel_loader = db._get_initial_loaders()
+    assert 'information_schema.statistics' in token_loader.sql
+    nsp_loader.consume([('app', 'App')])
+    token_loader.consume([('app.t1', '1/42')])
+    rel_loader.consume([('app.t1', 'T1', '', 'BASE TABLE', 'app', 'c')])
+    # Adding an index keeps the creation time of the table.
+    token_loader.consume([('app.t1', '2/99')])
+    rows = list(db._iter_relations(
+        [('app.t1', 'T1', '', 'BASE TABLE', 'app', 'c')]))
+    assert db._sync_nodes((Table,), rows) == (
+        [], [], [db.find_by_oid('app.t1')])